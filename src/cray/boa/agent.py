@@ -32,7 +32,7 @@ from botocore.exceptions import ClientError
 from . import ServiceNotReady, NontransientException
 from .bosclient import SessionStatus, BootSetStatus, now_string
 from .bosclient import SERVICE_ENDPOINT as BOS_SERVICE_ENDPOINT
-from cray.boa.connection import requests_retry_session
+from cray.boa.connection import requests_retry_session, shared_session
 from .capmcclient import graceful_shutdown, power, status
 from .cfsclient import CfsClient, wait_for_configuration
 from .bssclient import set_bss_urls
@@ -93,7 +93,6 @@ class BootSetAgent(object):
         self._session_data = None
         self._bos_client = None
         self._capmc_client = None
-        self._smd_client = None
         self._boot_artifacts = None
         self._session_status = None
         self._boot_set_status = None
@@ -101,6 +100,7 @@ class BootSetAgent(object):
         self._cfs_client = None
         self._preflight_check = None
         self._inventory = None
+        self._rootfs_provider_instance = None
         self.failed_nodes = set()
 
     @property
@@ -314,6 +314,17 @@ class BootSetAgent(object):
         """
         return self.boot_set_data.get('rootfs_provider', None)
 
+    @property
+    def rootfs_provider_instance(self):
+        """
+        The root filesystem provider for this boot set. It never changes, so it
+        is built once; this also preserves the provider's own cached values.
+        """
+        if self._rootfs_provider_instance is not None:
+            return self._rootfs_provider_instance
+        self._rootfs_provider_instance = ProviderFactory(self)()
+        return self._rootfs_provider_instance
+
     @property
     def rootfs_provider_passthrough(self):
         """
@@ -380,8 +391,7 @@ class BootSetAgent(object):
             boot_param_pieces.append(self.session_template_kernel_parameters)
 
         # Append special parameters for the rootfs and Node Memory Dump
-        pf = ProviderFactory(self)
-        provider = pf()
+        provider = self.rootfs_provider_instance
         rootfs_parameters = str(provider)
         if rootfs_parameters:
             boot_param_pieces.append(rootfs_parameters)
@@ -537,10 +547,11 @@ class BootSetAgent(object):
 
     @property
     def smd_client(self):
-        if self._smd_client:
-            return self._smd_client
-        self._smd_client = requests_retry_session()
-        return self._smd_client
+        """
+        The session used for HSM requests. Every boot set uses the process-wide
+        shared session, so that their concurrent node state queries are merged.
+        """
+        return shared_session()
 
     @property
     def session_status(self):
@@ -21,17 +21,22 @@
 # ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 # OTHER DEALINGS IN THE SOFTWARE.
 #
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from operator import itemgetter
 from requests.exceptions import HTTPError
+import json
 import logging
 import time
 import os
+import sys
 import uuid
 
 from cray.boa import NontransientException
 from . import PROTOCOL
 from .logutil import call_logger
-from .connection import requests_retry_session
+from .connection import shared_session
 
 LOGGER = logging.getLogger(__name__)
 SERVICE_NAME = 'cray-cfs-api'
@@ -42,6 +47,16 @@ COMPONENTS_ENDPOINT = "%s/components" % V2_ENDPOINT
 OPTIONS_ENDPOINT = "%s/options" % V2_ENDPOINT
 OPTIONS_V1_ENDPOINT = "%s/options" % V1_ENDPOINT
 CONFIGURATIONS_ENDPOINT = "%s/configurations" % V2_ENDPOINT
+# The number of component chunk queries issued to CFS concurrently, across all boot sets
+COMPONENT_QUERY_WORKERS = 16
+HANDLED_CONFIGURATION_STATUSES = frozenset(['configured', 'failed', 'pending'])
+# The longest period, in seconds, between checks of CFS component status
+MAXIMUM_CHECK_INTERVAL = 60
+
+
+# Shared by every CfsClient; its threads are started on demand and reused
+_COMPONENT_QUERY_EXECUTOR = ThreadPoolExecutor(max_workers=COMPONENT_QUERY_WORKERS,
+                                               thread_name_prefix='cfs-query')
 
 
 class CFSException(NontransientException):
@@ -69,9 +84,16 @@ class CfsClient(object):
     wrapper around the CFS api calls.
     """
     PATCH_BATCH_SIZE = 1000
+    PATCH_WORKERS = 8
 
     def __init__(self):
-        self._session = requests_retry_session()
+        self._session = shared_session()
+        # CFS options do not change over the course of a BOA run
+        self._default_clone_url = None
+        self._default_playbook = None
+        # The last known configurations listing and the ETag it was served with
+        self._configurations = None
+        self._configurations_etag = None
 
     def clear_configuration(self, node_ids):
         self._patch_desired_config(node_ids, '')
@@ -82,24 +104,35 @@ class CfsClient(object):
 
     @call_logger
     def _patch_desired_config(self, node_ids, desired_config, enabled=False, tags={}):
-        data = []
-        for node_id in node_ids:
-            data.append({
-                'id': node_id,
-                'enabled': enabled,
-                'desiredConfig': desired_config,
-                'tags': tags
-            })
-            if len(data) >= self.PATCH_BATCH_SIZE:
-                self._session.patch(COMPONENTS_ENDPOINT, json=data)
-                data = []
-        if data:
-            response = self._session.patch(COMPONENTS_ENDPOINT, json=data)
+        def patch_batch(batch):
+            # The component records for a batch are only built when it is sent
+            data = [{'id': node_id,
+                     'enabled': enabled,
+                     'desiredConfig': desired_config,
+                     'tags': tags} for node_id in batch]
+            # Encode compactly; requests pads every separator with a space
+            body = json.dumps(data, separators=(',', ':'))
+            return self._session.patch(COMPONENTS_ENDPOINT, data=body,
+                                       headers={'Content-Type': 'application/json'})
+
+        def check(future):
             try:
-                response.raise_for_status()
+                future.result().raise_for_status()
             except HTTPError as err:
                 LOGGER.error("Failed asking CFS to configure nodes: %s", err)
-                pass
+
+        remaining_ids = iter(node_ids)
+        batches = iter(lambda: list(islice(remaining_ids, self.PATCH_BATCH_SIZE)), [])
+        # Unlike executor.map, which slices every batch up front, only take the next
+        # batch once one of PATCH_WORKERS outstanding requests has completed
+        outstanding = deque()
+        with ThreadPoolExecutor(max_workers=self.PATCH_WORKERS) as executor:
+            for batch in batches:
+                if len(outstanding) >= self.PATCH_WORKERS:
+                    check(outstanding.popleft())
+                outstanding.append(executor.submit(patch_batch, batch))
+            while outstanding:
+                check(outstanding.popleft())
 
     def get_component(self, node_id):
         url = "%s/%s" % (COMPONENTS_ENDPOINT, node_id)
@@ -148,27 +181,80 @@ class CfsClient(object):
         return name
 
     def get_configurations(self):
-        response = self._session.get(CONFIGURATIONS_ENDPOINT)
+        """
+        Get the list of CFS configurations. When a previous listing was served with
+        an ETag, it is revalidated with CFS and reused if it has not changed.
+        """
+        headers = {}
+        if self._configurations_etag:
+            headers['If-None-Match'] = self._configurations_etag
+        response = self._session.get(CONFIGURATIONS_ENDPOINT, headers=headers)
+        if response.status_code == 304 and self._configurations is not None:
+            return self._configurations
         response.raise_for_status()
         data = response.json()
+        self._configurations_etag = response.headers.get('ETag')
+        self._configurations = data if self._configurations_etag else None
         return data
 
+    def invalidate_configurations(self):
+        """
+        Forget the cached configurations listing.
+        """
+        self._configurations = None
+        self._configurations_etag = None
+
     def update_configuration(self, config_id, data):
         url = "%s/%s" % (CONFIGURATIONS_ENDPOINT, config_id)
         response = self._session.put(url, json=data)
+        self.invalidate_configurations()
         response.raise_for_status()
 
     def get_default_clone_url(self):
-        response = self._session.get(OPTIONS_V1_ENDPOINT)
-        response.raise_for_status()
-        data = response.json()
-        return data['defaultCloneUrl']
+        if self._default_clone_url is None:
+            response = self._session.get(OPTIONS_V1_ENDPOINT)
+            response.raise_for_status()
+            data = response.json()
+            self._default_clone_url = data['defaultCloneUrl']
+        return self._default_clone_url
 
     def get_default_playbook(self):
-        response = self._session.get(OPTIONS_ENDPOINT)
-        response.raise_for_status()
-        data = response.json()
-        return data['defaultPlaybook']
+        if self._default_playbook is None:
+            response = self._session.get(OPTIONS_ENDPOINT)
+            response.raise_for_status()
+            data = response.json()
+            self._default_playbook = data['defaultPlaybook']
+        return self._default_playbook
+
+
+def _get_components_chunked(cfs_client, component_ids, size=25):
+    """
+    Query CFS for a potentially large number of components. The ids are split into
+    chunks of <size>, and the chunks are requested concurrently using the thread
+    pool shared by all clients.
+    Args:
+      cfs_client (CfsClient): The client used to query CFS
+      component_ids: A collection (e.g. a set) of component ids
+      size: The maximum number of component ids requested at once
+    Yields: The list of components returned for each chunk, as soon as it is available,
+      so that callers can process responses while the remaining chunks are in flight.
+      Component ids are interned so that they compare by identity with interned node ids.
+    """
+    remaining_ids = iter(component_ids)
+    chunks = (','.join(chunk) for chunk in iter(lambda: list(islice(remaining_ids, size)), []))
+    chunk_count = -(-len(component_ids) // size)
+
+    def get_components(ids):
+        components_data = cfs_client.get_components(ids=ids)
+        for component in components_data:
+            component['id'] = sys.intern(component['id'])
+        return components_data
+
+    if chunk_count <= 1:
+        for ids in chunks:
+            yield get_components(ids)
+        return
+    yield from _COMPONENT_QUERY_EXECUTOR.map(get_components, chunks)
 
 
 def wait_for_configuration(boot_set_agent, maximum_duration=1800, check_interval=5,
@@ -181,7 +267,9 @@ def wait_for_configuration(boot_set_agent, maximum_duration=1800, check_interval
           and appropriate status reporting/aggregating methods
       maximum_duration: The period of time, in seconds, that we wait for components to
         become configured. When set to zero, wait indefinitely
-      check_interval: The period of time between calls to CFS for component information
+      check_interval: The period of time between calls to CFS for component information;
+        when no components complete between calls, this period grows up to
+        MAXIMUM_CHECK_INTERVAL and returns to check_interval once they do
       success_threshold: This float value defines the percentage of nodes that must complete
         successfully in order for the configuration to be deemed complete. When the number of
         nodes have explicitly failed configuration (as indicated by those nodes reaching their
@@ -199,8 +287,10 @@ def wait_for_configuration(boot_set_agent, maximum_duration=1800, check_interval
         end_time = time.time() + (60 * 60 * 24 * 365 * 100)
     else:
         end_time = time.time() + maximum_duration
-    check_interval = os.getenv("CFS_COMPLETION_SLEEP_INTERVAL", check_interval)
-    nodes = set(boot_set_agent.nodes)
+    check_interval = float(os.getenv("CFS_COMPLETION_SLEEP_INTERVAL", check_interval))
+    interval = check_interval
+    # Interned ids hash and compare cheaply in the set operations repeated every poll
+    nodes = {sys.intern(node) for node in boot_set_agent.nodes}
     nodes_count = len(nodes)
     allowable_failures = (1.0 - success_threshold) * nodes_count
     nodes_required_for_success = nodes_count - allowable_failures
@@ -209,22 +299,23 @@ def wait_for_configuration(boot_set_agent, maximum_duration=1800, check_interval
     remaining_components = nodes
     successful_components_count = 0
     failed_components_count = 0
+    get_id = itemgetter('id')
     while time.time() < end_time:
+        iteration_start = time.time()
         # GET COMPONENT INFORMATION
         # We can only request so many ids at a time or the request is too large.
         # A chunk size of 25 keeps us below the 4096 byte maximum request size when using xnames.
         # Once CFS/BOS supports tagging components with the "owner", this can be replaced
         # with querying on the session name/tag, although paging on large responses may be needed.
-        seq = list(remaining_components)
-        size = 25
         components_config_map = defaultdict(set)
         components = set()
-        for chunk in [seq[pos:pos + size] for pos in range(0, len(seq), size)]:
-            components_data = boot_set_agent.cfs_client.get_components(ids=','.join(chunk))
-            components |= {component['id'] for component in components_data}
+        for components_data in _get_components_chunked(boot_set_agent.cfs_client,
+                                                        remaining_components):
             for component in components_data:
+                component_id = get_id(component)
+                components.add(component_id)
                 components_config_map[component.get(
-                    'configurationStatus', 'undefined')].add(component['id'])
+                    'configurationStatus', 'undefined')].add(component_id)
 
         # LOG COMPONENT STATUS INFORMATION
         # Report Completed Nodes' Status
@@ -243,7 +334,7 @@ def wait_for_configuration(boot_set_agent, maximum_duration=1800, check_interval
             errors['Status could not be retrieved from CFS'] = list(removed_components)
             failed_components |= removed_components
         for status, status_components in components_config_map.items():
-            if status not in ['configured', 'failed', 'pending']:
+            if status not in HANDLED_CONFIGURATION_STATUSES:
                 # Can occur if the components desired configuration was unset
                 msg = 'Component entered the unhandled status "{}"'.format(status)
                 errors[msg] = list(status_components)
@@ -257,6 +348,12 @@ def wait_for_configuration(boot_set_agent, maximum_duration=1800, check_interval
         # Update Boot Set Agent's failed components
         boot_set_agent.failed_nodes |= failed_components
 
+        # Check again sooner while components are completing, back off while they are not
+        if successful_components or failed_components:
+            interval = check_interval
+        else:
+            interval = min(interval * 1.5, max(check_interval, MAXIMUM_CHECK_INTERVAL))
+
         # CHECK EXIT CONDITIONS
         if failed_components_count > allowable_failures:
             msg = """Maximum number of nodes have failed configuration criteria threshold;
@@ -264,6 +361,8 @@ def wait_for_configuration(boot_set_agent, maximum_duration=1800, check_interval
                   These nodes failed configuration: %s""" % (', '.join(sorted(failed_components)))
             raise CFSExhaustedRetries(msg)
         # If all components have reached a completed state, exit.
+        if successful_components_count + failed_components_count >= nodes_count:
+            return
         remaining_components = components_config_map['pending']
         if not remaining_components:
             return
@@ -281,7 +380,8 @@ def wait_for_configuration(boot_set_agent, maximum_duration=1800, check_interval
             LOGGER.info(new_status_msg)
             last_status_time = time.time()
             last_status = new_status_msg
-        time.sleep(check_interval)
+        # Poll on a fixed cadence; time spent waiting on CFS counts towards the interval
+        time.sleep(max(0, iteration_start + interval - time.time()))
 
     # Here, we've found ourselves in the unenviable position where we have less than
     # 100% of the nodes configured, and our time has run out.
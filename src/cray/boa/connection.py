@@ -35,17 +35,88 @@ Created on Aug 23, 2019
 @author: jsl
 '''
 
+import atexit
 from functools import partial
 import logging
+import threading
 
+from requests.adapters import HTTPAdapter
 from requests_retry_session import requests_retry_session as base_requests_retry_session
 
 from cray.boa import PROTOCOL
 
 LOGGER = logging.getLogger(__name__)
 
+# Connection pool sizing for the mounted adapters; urllib3 defaults to 10 of each,
+# which is smaller than the number of concurrent requests some callers issue.
+POOL_CONNECTIONS = 32
+POOL_MAXSIZE = 64
 
-requests_retry_session = partial(base_requests_retry_session, retries=128, backoff_factor=0.01, protocol=PROTOCOL)
+_base_requests_retry_session = partial(base_requests_retry_session, retries=128,
+                                       backoff_factor=0.01, protocol=PROTOCOL)
+
+
+def requests_retry_session(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, **kwargs):
+    """
+    Create a requests session with an HTTP retry adapter attached to it. The
+    session's adapters are replaced with ones of the same class that keep the
+    same retry policy and default timeout but have connection pools sized so
+    that concurrent requests reuse existing connections rather than opening
+    new ones.
+
+    Args:
+      pool_connections: The number of connection pools to cache
+      pool_maxsize: The maximum number of connections to keep in each pool
+      kwargs: Passed through to the underlying retry session constructor
+    Returns:
+      A requests session
+    """
+    session = _base_requests_retry_session(**kwargs)
+    for prefix, adapter in list(session.adapters.items()):
+        if isinstance(adapter, HTTPAdapter):
+            # Rebuild the adapter as its own class so that a timeout adapter keeps
+            # applying its default timeout to requests that do not set one.
+            adapter_kwargs = {}
+            if getattr(adapter, 'timeout', None) is not None:
+                adapter_kwargs['timeout'] = adapter.timeout
+            session.mount(prefix, type(adapter)(pool_connections=pool_connections,
+                                                pool_maxsize=pool_maxsize,
+                                                max_retries=adapter.max_retries,
+                                                **adapter_kwargs))
+    return session
+
+
+_SHARED_SESSION = None
+_SHARED_SESSION_LOCK = threading.Lock()
+
+
+def shared_session():
+    """
+    Return a retry session shared by the whole process. Clients that use it
+    share one set of connection pools, so connections opened by one client
+    stay warm for the others.
+    """
+    global _SHARED_SESSION
+    if _SHARED_SESSION is None:
+        with _SHARED_SESSION_LOCK:
+            if _SHARED_SESSION is None:
+                _SHARED_SESSION = requests_retry_session()
+    return _SHARED_SESSION
+
+
+def close_shared_session():
+    """
+    Close the shared session, releasing its pooled connections. A later call to
+    shared_session() creates a new one.
+    """
+    global _SHARED_SESSION
+    with _SHARED_SESSION_LOCK:
+        session, _SHARED_SESSION = _SHARED_SESSION, None
+    if session is not None:
+        session.close()
+
+
+atexit.register(close_shared_session)
 
 
 def wait_for_istio_proxy():
@@ -64,5 +135,7 @@ if __name__ == '__main__':
     LOGGER.info("Running")
     retry_session = requests_retry_session()
     LOGGER.info(retry_session.get('https://httpstat.us/200').status_code)
+    LOGGER.info("Connection pool size: %s",
+                retry_session.get_adapter('https://').poolmanager.connection_pool_kw['maxsize'])
     retry_session = requests_retry_session(retries=5)
     LOGGER.info(retry_session.get('https://httpstat.us/503').status_code)
@@ -25,6 +25,23 @@
 A collection of default settings to use with logging service, should they not
 be specified explicitly in either client or service.
 """
+import struct
 
+# The service binds to all interfaces; clients connect over loopback. Both
+# are literal addresses so that no resolver lookup happens at import time.
+DEFAULT_HOST = ''
+DEFAULT_CLIENT_HOST = '127.0.0.1'
 DEFAULT_PORT = 65432
+# Local socket used by the AF_UNIX (SOCK_SEQPACKET) transport
+DEFAULT_SOCKET_PATH = '/tmp/cray-boa-log.sock'
 ENCODING = 'utf-8'
+# Wire format for log records: 'msgpack' or 'json'. Clients and the receiver
+# must agree on it.
+SERIALIZER = 'msgpack'
+SERIALIZERS = ('msgpack', 'json')
+
+# Every record on the wire is preceded by its length as a 4-byte big-endian int
+HEADER = struct.Struct('>L')
+# Largest record the stream receiver accepts. A longer length prefix means the
+# stream is not framed (e.g. a client from an earlier release) or is corrupt.
+MAX_FRAME_SIZE = 16 * 1024 * 1024
@@ -27,21 +27,81 @@ Created on Jul 3, 2019
 @author: jsl
 '''
 
+import json
 import logging.handlers
+import socket
 import msgpack
-from socket import gethostbyname
 
-from cray.boa.log import DEFAULT_PORT
+from cray.boa.log import DEFAULT_CLIENT_HOST, DEFAULT_PORT, DEFAULT_SOCKET_PATH, ENCODING, HEADER, \
+    SERIALIZER, SERIALIZERS
 
 
 class MsgpackHandler(logging.handlers.SocketHandler):
-    def __init__(self, host=gethostbyname(''), port=DEFAULT_PORT):
+    def __init__(self, host=DEFAULT_CLIENT_HOST, port=DEFAULT_PORT, serializer=SERIALIZER):
         logging.handlers.SocketHandler.__init__(self,host,port)
+        if serializer not in SERIALIZERS:
+            raise ValueError("Unknown log serializer '%s'; expected one of %s" % (serializer, SERIALIZERS))
+        if serializer == 'json':
+            self._dumps = self._json_dumps
+        else:
+            # makePickle is only called from emit, which runs under the handler
+            # lock, so a single packer can be shared by every record.
+            self._dumps = msgpack.Packer(use_bin_type=True, default=str).pack
+
+    @staticmethod
+    def _json_dumps(fields):
+        # Like the msgpack packer, send anything json cannot encode as its str()
+        return json.dumps(fields, separators=(',', ':'), default=str).encode(ENCODING)
+
+    def _serializable(self, record):
+        """
+        Return a copy of the record's attributes for the serializer. As with
+        the stock SocketHandler, the message is merged with its arguments and
+        any traceback is rendered to exc_text on the client, so the receiver
+        can use the unpacked dict as is. Other attributes, such as those passed
+        with extra=, are sent as their str() if the serializer cannot encode
+        them natively.
+        """
+        if record.exc_info:
+            # Populates record.exc_text as a side effect
+            self.format(record)
+        fields = record.__dict__.copy()
+        fields['msg'] = record.getMessage()
+        fields['args'] = None
+        fields['exc_info'] = None
+        fields.pop('message', None)
+        return fields
 
     def makePickle(self,record):
-        # Use msgpack instead of pickle, for increased safety and portability
-        # between versions of python
-        return msgpack.packb(record.__dict__)
+        # Use msgpack (or json) instead of pickle, for increased safety and
+        # portability between versions of python. Like the stock SocketHandler, frame each
+        # record with its length so the receiver can split the stream.
+        data = self._dumps(self._serializable(record))
+        return HEADER.pack(len(data)) + data
+
+
+class UnixSeqpacketHandler(MsgpackHandler):
+    """
+    Forward records to a receiver on the same host over an AF_UNIX
+    SOCK_SEQPACKET socket. Each record is sent as a single packet, so no
+    length prefix is needed.
+    """
+    def __init__(self, path=DEFAULT_SOCKET_PATH, serializer=SERIALIZER):
+        # A port of None makes SocketHandler treat the host as a socket path
+        MsgpackHandler.__init__(self, path, None, serializer)
+
+    def makeSocket(self, timeout=1):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(self.address)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def makePickle(self, record):
+        return self._dumps(self._serializable(record))
 
 
 if __name__ == '__main__':
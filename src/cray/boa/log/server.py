@@ -31,46 +31,129 @@ Created on Jul 3, 2019
 @author: jsl
 '''
 
+import errno
+import json
 import logging
 import logging.handlers
+import os
+import queue
+import selectors
+import socket
 import socketserver
+import stat
 import msgpack
 import time
 import threading
 
-from socket import gethostbyname
-from cray.boa.log import DEFAULT_PORT, ENCODING
+from cray.boa.log import DEFAULT_HOST, DEFAULT_PORT, DEFAULT_SOCKET_PATH, HEADER, \
+    MAX_FRAME_SIZE, SERIALIZER, SERIALIZERS
 
+LOGGER = logging.getLogger(__name__)
 
-class LogRecordStreamHandler(socketserver.StreamRequestHandler):
+
+def _json_loads(data):
+    return json.loads(bytes(data))
+
+
+def _msgpack_loads(data):
+    # Strings are decoded to str by msgpack itself while unpacking
+    return msgpack.unpackb(data, raw=False)
+
+
+# Decoders for each supported serializer; each accepts a bytes-like object
+LOADERS = {'json': _json_loads,
+           'msgpack': _msgpack_loads}
+
+
+class LogRecordStreamHandler(object):
     """
-    Handler for a streaming logging request.
+    Handler for a streaming logging connection.
 
     This basically logs the record using whatever logging policy is
     configured locally. Typically, this is the global root logger (but can handle
     any defined logger in the current defined namespace).
+
+    One handler exists per connected client; it owns any partially received
+    frame for that connection and is driven by the receiver's selector thread whenever
+    the socket becomes readable.
     """
 
-    def handle(self):
+    def __init__(self, request, client_address, server):
+        self.request = request
+        self.client_address = client_address
+        self.server = server
+        self.setup()
+
+    def setup(self):
+        # Bytes of a partially received frame, carried over between reads
+        self.partial = bytearray()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, True)
+        self.request.setblocking(False)
+
+    def handle_read(self, buff, view):
         """
-        Handle multiple requests - each expected to be a 4-byte length,
-        followed by the LogRecord in pickle format. Logs the record
-        according to whatever policy is configured locally.
+        Read whatever is available on the connection into <buff> and log every
+        complete record received so far.
+
+        Args:
+          buff (bytearray): Receive buffer shared by all connections
+          view (memoryview): A view over buff
+
+        Returns:
+          False once the peer has closed the connection or the connection
+          has to be dropped, True otherwise
         """
-        unp = msgpack.Unpacker()
-        while True:
-            r = self.request.recv(1000)
-            if not r:
+        try:
+            nbytes = self.request.recv_into(buff)
+        except BlockingIOError:
+            return True
+        if not nbytes:
+            return False
+        if not self.partial:
+            # Common case: decode straight out of the receive buffer and only
+            # keep whatever trailing fragment is left over.
+            consumed = self.handle_frames(view[:nbytes])
+            if consumed is None:
+                return False
+            self.partial += view[consumed:nbytes]
+        else:
+            self.partial += view[:nbytes]
+            with memoryview(self.partial) as partial:
+                consumed = self.handle_frames(partial)
+            if consumed is None:
+                return False
+            del self.partial[:consumed]
+        return True
+
+    def handle_frames(self, data):
+        """
+        Log every complete length-prefixed record in <data>.
+
+        Args:
+          data (memoryview): Received bytes, starting at a frame boundary
+
+        Returns:
+          The number of bytes consumed, or None if a frame's length exceeds
+          MAX_FRAME_SIZE and the connection should be dropped
+        """
+        offset = 0
+        available = len(data)
+        while available - offset >= HEADER.size:
+            size, = HEADER.unpack_from(data, offset)
+            if size > MAX_FRAME_SIZE:
+                # Rather than buffer up to 4 GiB waiting for the frame to end
+                LOGGER.warning("Dropping log connection from %s; it sent a %d byte frame, "
+                               "larger than the %d byte limit. The client may not be "
+                               "sending length-prefixed records.",
+                               self.client_address, size, MAX_FRAME_SIZE)
+                return None
+            end = offset + HEADER.size + size
+            if end > available:
                 break
-            unp.feed(r)
-            for obj in unp:
-                sanitized = {}
-                for key, val in obj.items():
-                    if isinstance(val, bytes):
-                        val = str(val, ENCODING)
-                    sanitized[str(key, ENCODING)] = val
-                record = logging.makeLogRecord(sanitized)
-                self.handleLogRecord(record)
+            obj = self.server.loads(data[offset + HEADER.size:end])
+            self.handleLogRecord(logging.makeLogRecord(obj))
+            offset = end
+        return offset
 
     def handleLogRecord(self, record):
         # if a name is specified, we use the named logger rather than the one
@@ -82,7 +165,12 @@ class LogRecordStreamHandler(socketserver.StreamRequestHandler):
                 name = record.name
         except AttributeError:
             name = record.name
-        logger = logging.getLogger(name)
+        # getLogger takes the logging module lock; logger names are few, so
+        # resolve each one once per receiver.
+        try:
+            logger = self.server.loggers[name]
+        except KeyError:
+            logger = self.server.loggers[name] = logging.getLogger(name)
         # N.B. EVERY record gets logged. This is because Logger.handle
         # is normally called AFTER logger-level filtering. If you want
         # to do filtering, do it at the client end to save wasting
@@ -90,18 +178,193 @@ class LogRecordStreamHandler(socketserver.StreamRequestHandler):
         logger.handle(record)
 
 
-class LogRecordSocketReceiver(socketserver.ThreadingTCPServer):
+class LogRecordPacketHandler(LogRecordStreamHandler):
+    """
+    Handler for a SOCK_SEQPACKET logging connection.
+
+    Each packet carries exactly one record, so no length framing or carry-over
+    state is needed.
+    """
+
+    def setup(self):
+        self.request.setblocking(False)
+
+    def handle_read(self, buff, view):
+        try:
+            # MSG_TRUNC reports the full packet length even if it did not fit
+            nbytes = self.request.recv_into(buff, 0, socket.MSG_TRUNC)
+        except BlockingIOError:
+            return True
+        if not nbytes:
+            return False
+        if nbytes > len(buff):
+            LOGGER.warning("Dropped a %d byte log record from %s; it exceeds the %d byte "
+                           "receive buffer.", nbytes, self.client_address, len(buff))
+            return True
+        self.handleLogRecord(logging.makeLogRecord(self.server.loads(view[:nbytes])))
+        return True
+
+
+class LogRecordSocketReceiver(socketserver.TCPServer):
     """
-    Simple TCP socket-based logging receiver suitable for small loads.
+    TCP socket-based logging receiver.
+
+    Connections are accepted by serve_forever as usual, but rather than
+    spawning a thread per connection, each accepted socket is handed to a
+    single reader thread that multiplexes every client with a selector.
     """
     allow_reuse_address = 1
+    # Let several receiver processes share the port, with the kernel spreading
+    # connections between them; off unless asked for, so that a second
+    # receiver otherwise fails to bind rather than taking over connections
+    share_port = False
+    # Listen backlog; a boot storm connects many agents at once
+    request_queue_size = 128
+    RECEIVE_BUFFER_SIZE = 65536
 
     def __init__(self,
-                 host=gethostbyname(''),
+                 host=DEFAULT_HOST,
                  port=DEFAULT_PORT,
-                 handler=LogRecordStreamHandler):
-        socketserver.ThreadingTCPServer.__init__(self, (host, port), handler)
+                 handler=LogRecordStreamHandler,
+                 serializer=SERIALIZER,
+                 share_port=False):
+        self.share_port = share_port
+        self._init_server((host, port), handler, serializer)
+
+    def _init_server(self, server_address, handler, serializer):
+        if serializer not in SERIALIZERS:
+            raise ValueError("Unknown log serializer '%s'; expected one of %s" % (serializer, SERIALIZERS))
+        self.loads = LOADERS[serializer]
+        # Logger name -> Logger, only touched by the reader thread
+        self.loggers = {}
         self.timeout = 1
+        # Set up before binding so that server_close works if binding fails
+        self._selector = selectors.DefaultSelector()
+        self._pending = queue.SimpleQueue()
+        self._closing = threading.Event()
+        # Wakes the reader thread when a connection is accepted or on close
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._selector.register(self._wakeup_recv, selectors.EVENT_READ)
+        self._reader = threading.Thread(target=self._serve_connections,
+                                        name='log-receiver', daemon=True)
+        socketserver.TCPServer.__init__(self, server_address, handler)
+        self._reader.start()
+
+    def server_bind(self):
+        if (self.share_port and hasattr(socket, 'SO_REUSEPORT')
+                and self.address_family in (socket.AF_INET, socket.AF_INET6)):
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        socketserver.TCPServer.server_bind(self)
+
+    def process_request(self, request, client_address):
+        """
+        Hand a newly accepted connection to the reader thread.
+        """
+        self._pending.put((request, client_address))
+        self._wakeup_send.send(b'\0')
+
+    def _register_pending(self):
+        try:
+            while self._wakeup_recv.recv(1024):
+                pass
+        except BlockingIOError:
+            pass
+        while True:
+            try:
+                request, client_address = self._pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                handler = self.RequestHandlerClass(request, client_address, self)
+                self._selector.register(request, selectors.EVENT_READ, handler)
+            except Exception:
+                self.handle_error(request, client_address)
+                self.shutdown_request(request)
+
+    def _close_connection(self, request):
+        self._selector.unregister(request)
+        self.shutdown_request(request)
+
+    def _serve_connections(self):
+        """
+        Service every connected client from a single thread until the
+        receiver is closed.
+        """
+        buff = bytearray(self.RECEIVE_BUFFER_SIZE)
+        view = memoryview(buff)
+        while not self._closing.is_set():
+            for key, _ in self._selector.select(timeout=self.timeout):
+                handler = key.data
+                if handler is None:
+                    self._register_pending()
+                    continue
+                try:
+                    if not handler.handle_read(buff, view):
+                        self._close_connection(key.fileobj)
+                except Exception:
+                    self.handle_error(key.fileobj, handler.client_address)
+                    self._close_connection(key.fileobj)
+
+    def server_close(self):
+        self._closing.set()
+        self._wakeup_send.send(b'\0')
+        if self._reader.is_alive():
+            self._reader.join()
+        for key in list(self._selector.get_map().values()):
+            if key.data is not None:
+                self.shutdown_request(key.fileobj)
+        self._selector.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
+        socketserver.TCPServer.server_close(self)
+
+
+def _remove_stale_socket(path):
+    """
+    Remove the socket a previous receiver left behind at <path>. Anything else
+    there, including a socket that still has a receiver listening on it, is left
+    alone and an error is raised instead.
+    """
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(errno.EEXIST, "Not a socket; refusing to remove it", path)
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        # Nobody is listening; the socket is stale
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise OSError(errno.EADDRINUSE, "A log receiver is already listening", path)
+
+
+class LogRecordSeqpacketReceiver(LogRecordSocketReceiver):
+    """
+    Logging receiver for clients on the same host, listening on an AF_UNIX
+    SOCK_SEQPACKET socket. Every packet is one complete record.
+    """
+    address_family = socket.AF_UNIX
+    socket_type = socket.SOCK_SEQPACKET
+
+    def __init__(self,
+                 path=DEFAULT_SOCKET_PATH,
+                 handler=LogRecordPacketHandler,
+                 serializer=SERIALIZER):
+        _remove_stale_socket(path)
+        self._init_server(path, handler, serializer)
+
+    def server_close(self):
+        LogRecordSocketReceiver.server_close(self)
+        try:
+            os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
 
 
 def test_service():
@@ -115,6 +378,7 @@ def test_service():
     print("launched")
     time.sleep(20)
     tcpserver.shutdown()
+    tcpserver.server_close()
     print("service finished")
 
 
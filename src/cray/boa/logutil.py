@@ -38,19 +38,20 @@ def call_logger(func):
     This is a decorator which wraps a function and logs the function's call name
     and parameters to the logging stream at the debug level.
     """
+    # Resolve the name once, at decoration time, rather than on every call
+    try:
+        qualified_name = "%s.%s" % (func.__module__, func.__name__)
+    except AttributeError:
+        qualified_name = repr(func)
+
     @wraps(func)
     def wrapper(*args, **kwargs):
-        if args or kwargs:
-            try:
-                msgbuff = ["{}.{} called with ".format(func.__module__, func.__name__)]
-            except (AttributeError, TypeError):
-                msgbuff = ["Called with "]
-            if args:
-                msgbuff.append("args: {}".format(args))
-            if kwargs:
-                msgbuff.append("kwargs: {}".format(kwargs))
-            LOGGER.debug(' '.join(msgbuff))
-        else:
-            LOGGER.debug("%s.%s called.", func.__module__, func.__name__)
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            # Arguments are interpolated by the logging module, and only if the
+            # record is actually emitted.
+            if args or kwargs:
+                LOGGER.debug("%s called with args: %r kwargs: %r", qualified_name, args, kwargs)
+            else:
+                LOGGER.debug("%s called.", qualified_name)
         return func(*args, **kwargs)
     return wrapper
@@ -33,7 +33,8 @@ Created on Jun 6, 2019
 
 import logging
 import importlib
-from requests.exceptions import HTTPError, ConnectionError
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.exceptions import HTTPError, ConnectionError, RetryError
 import os
 
 from botocore.exceptions import ClientError, ConnectionClosedError
@@ -49,6 +50,11 @@ from .connection import requests_retry_session
 
 LOGGER = logging.getLogger(__name__)
 VERIFY = False
+# (connect, read) timeouts in seconds for each attempt of a service probe
+CHECK_TIMEOUT = (3.0, 5.0)
+# Retries for each service probe; a probe gives up after CHECK_RETRIES + 1
+# attempts rather than the default retry session's 128
+CHECK_RETRIES = 1
 
 
 class PreflightCheck(object):
@@ -57,15 +63,17 @@ class PreflightCheck(object):
     on the action, various microservices do not need to be fully functional.
     """
     ACTIONCHECK = {}
-    ACTIONCHECK['boot'] = frozenset(['rootfs', 's3', 'bss', 'capmc', 'smd', 'rootfs'])
-    ACTIONCHECK['shutdown'] = frozenset(['capmc', 'smd'])
+    ACTIONCHECK['boot'] = ('rootfs', 's3', 'bss', 'capmc', 'smd')
+    ACTIONCHECK['shutdown'] = ('capmc', 'smd')
     ACTIONCHECK['reboot'] = ACTIONCHECK['boot']
-    ACTIONCHECK['configure'] = frozenset(['cfs'])
+    ACTIONCHECK['configure'] = ('cfs',)
     ACTIONCHECK['reconfigure'] = ACTIONCHECK['configure']
+    # Rootfs provider name -> its check function (or None), resolved once
+    _ROOTFS_CACHE = {}
 
     def __init__(self, agent, action, rootfs_provider=None):
         self.agent = agent
-        self.session = requests_retry_session()
+        self.session = requests_retry_session(retries=CHECK_RETRIES)
         self.action = action.lower()
         self.rootfs_provider = rootfs_provider
         if self.action not in self.ACTIONCHECK:
@@ -73,15 +81,10 @@ class PreflightCheck(object):
                            "it is not implemented.", self.action)
 
         # Build up a set of checks to perform; this is a one-time initialization
-        self.checks = set()
-        for checktype in self.ACTIONCHECK[self.action]:
-            try:
-                self.checks.add(getattr(self, 'check_%s' % (checktype)))
-            except AttributeError:
-                LOGGER.warning("Check type '%s' not implemented for action '%s'",
-                               checktype, self.action)
-        if self.agent.cfs_enabled:
-            self.checks.add(self.check_cfs)
+        self.checks = tuple(getattr(self, name)
+                            for name in self._CHECK_METHODS.get(self.action, ()))
+        if self.agent.cfs_enabled and self.check_cfs not in self.checks:
+            self.checks += (self.check_cfs,)
 
     def __call__(self):
         """
@@ -91,24 +94,43 @@ class PreflightCheck(object):
             LOGGER.info("Running preflight checks.")
         else:
             return
-        for check_function in self.checks:
-            try:
-                check_function()
-            except ServiceNotReady as snr:
-                LOGGER.warning("Preflight check %s failed: %s", check_function.__name__, snr)
+        # The checks are independent requests against different services; run them
+        # concurrently so that the total time is that of the slowest check.
+        with ThreadPoolExecutor(max_workers=len(self.checks)) as executor:
+            futures = {executor.submit(check_function): check_function
+                       for check_function in self.checks}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except ServiceNotReady as snr:
+                    LOGGER.warning("Preflight check %s failed: %s", futures[future].__name__, snr)
         LOGGER.info("Preflight checks done.")
 
     @call_logger
     def check_rootfs(self):
         if not self.rootfs_provider:
             return None
+        try:
+            return self._ROOTFS_CACHE[self.rootfs_provider]
+        except KeyError:
+            pass
+        check = self._ROOTFS_CACHE[self.rootfs_provider] = self._find_rootfs_check()
+        return check
+
+    def _find_rootfs_check(self):
+        """
+        Find the health check function implemented by the rootfs provider.
+
+        Returns:
+          The provider's check function, or None if there is not one
+        """
         # In this case, we need to dynamically import the rootfs check from
         # the individual implementers.
         module_path = 'cray.boa.rootfs.%s' % (self.rootfs_provider)
         try:
             module = importlib.import_module(module_path)
         except ImportError:
-            LOGGER.ERROR("Preflight check for %s -- could not find module %s",
+            LOGGER.error("Preflight check for %s -- could not find module %s",
                          self.rootfs_provider, module_path)
             return None
         check_function = "check_%s" % self.rootfs_provider
@@ -119,11 +141,21 @@ class PreflightCheck(object):
                            self.rootfs_provider)
             return None
 
-    def check_uri(self, uri):
+    def check_uri(self, uri, method='GET'):
+        """
+        Check that <uri> responds successfully to a <method> request.
+
+        Only the status is of interest, so the response is streamed and closed
+        without reading the body.
+        """
         try:
-            response = self.session.get(uri, verify=VERIFY)
-            response.raise_for_status()
-        except (HTTPError, ConnectionError) as requests_error:
+            response = self.session.request(method, uri, verify=VERIFY, stream=True,
+                                            timeout=CHECK_TIMEOUT)
+            try:
+                response.raise_for_status()
+            finally:
+                response.close()
+        except (HTTPError, ConnectionError, RetryError) as requests_error:
             raise ServiceNotReady("Service not responsive: %s" % (requests_error)) from requests_error
 
     def check_bss(self):
@@ -148,3 +180,32 @@ class PreflightCheck(object):
         except (ClientError, ConnectionClosedError, S3MissingConfiguration) as error:
             raise ServiceNotReady("Service not responsive: %s" % (error)) from error
 
+
+def _check_methods(cls):
+    """
+    Resolve the names of the check methods implemented for each action.
+
+    Args:
+      cls: The PreflightCheck class
+
+    Returns:
+      A dictionary mapping each action to a tuple of check method names
+    """
+    check_methods = {}
+    for action, checktypes in cls.ACTIONCHECK.items():
+        names = []
+        for checktype in checktypes:
+            name = 'check_%s' % (checktype)
+            if name in names:
+                continue
+            if hasattr(cls, name):
+                names.append(name)
+            else:
+                LOGGER.warning("Check type '%s' not implemented for action '%s'",
+                               checktype, action)
+        check_methods[action] = tuple(names)
+    return check_methods
+
+
+# Computed once at import rather than probed on every PreflightCheck instance
+PreflightCheck._CHECK_METHODS = _check_methods(PreflightCheck)
@@ -47,17 +47,27 @@ class RootfsProvider(object):
     This class is intended to be inherited by various kinds of root Provider provisioning
     mechanisms.
     """
+    __slots__ = ('agent', '_str_cache', '_nmd_cache')
 
     def __init__(self, agent):
         """
         Given an agent, extrapolate the required boot parameter value.
         """
         self.agent = agent
+        # The agent's boot set and artifacts do not change over its lifetime,
+        # so the rendered parameters are computed once.
+        self._str_cache = None
+        self._nmd_cache = None
 
     def __str__(self):
         """
         The value to add to the boot parameter.
         """
+        if self._str_cache is None:
+            self._str_cache = self._root_parameter()
+        return self._str_cache
+
+    def _root_parameter(self):
         fields = []
         if self.PROTOCOL:
             fields.append(self.PROTOCOL)
@@ -48,6 +48,7 @@ ENDPOINT = '%s://%s/%s' % (PROTOCOL, SERVICE_NAME, VERSION)
 
 class CPSS3Provider(RootfsProvider):
     PROTOCOL = 'craycps-s3'
+    __slots__ = ()
 
     @property
     def provider_field(self):
@@ -63,15 +64,19 @@ class CPSS3Provider(RootfsProvider):
         The value to add to the kernel boot parameters for Node Memory Dump (NMD)
         parameter.
         """
-        fields = []
-        if self.provider_field:
-            fields.append("url=%s" % self.provider_field)
-        if self.provider_field_id:
-            fields.append("etag=%s" % self.provider_field_id)
-        if fields:
-            return "nmd_data={}".format(",".join(fields))
-        else:
-            return ''
+        if self._nmd_cache is None:
+            self._nmd_cache = self._nmd_parameter()
+        return self._nmd_cache
+
+    def _nmd_parameter(self):
+        url, etag = self.provider_field, self.provider_field_id
+        if url and etag:
+            return "nmd_data=url=%s,etag=%s" % (url, etag)
+        if url:
+            return "nmd_data=url=%s" % url
+        if etag:
+            return "nmd_data=etag=%s" % etag
+        return ''
 
 
 def check_cpss3(session=None):
@@ -35,6 +35,41 @@ from ..logutil import call_logger
 
 LOGGER = logging.getLogger(__name__)
 
+# Provider name -> provider class, filled in as each provider is first requested
+_REGISTRY = {}
+
+
+def _load_provider_class(provider_name):
+    """
+    Import the module implementing <provider_name> and return its provider class.
+
+    Args:
+      provider_name (str): Lowercase provider name; empty for the default provider
+    Returns:
+      The RootfsProvider subclass implementing the provider
+    Raises:
+      ProviderNotImplemented: if no module implements the provider
+    """
+    if provider_name:
+        # When a provisioning protocol is specified...
+        provider_module = 'cray.boa.rootfs.{}'.format(provider_name)
+        provider_classname = '{}Provider'.format(provider_name.upper())
+    else:
+        # none specified or blank
+        provider_module = 'cray.boa.rootfs'
+        provider_classname = 'RootfsProvider'
+
+    # Import the Provider's provisioning model
+    try:
+        module = importlib.import_module(provider_module)
+    except ModuleNotFoundError as mnfe:
+        # This is pretty much unrecoverable at this stage of development; make note and raise
+        LOGGER.error("Provider provisioning mechanism '%s' not yet implemented or not found.", provider_name)
+        raise ProviderNotImplemented(mnfe) from mnfe
+
+    return getattr(module, provider_classname)
+
+
 class ProviderFactory(object):
     """
     Conditionally creates new instances of rootfilesystem providers based on
@@ -42,27 +77,13 @@ class ProviderFactory(object):
     """
     def __init__(self, agent):
         self.agent = agent
+        # A boot set without a rootfs_provider uses the default provider
+        self.provider_name = (agent.rootfs_provider or '').lower()
 
     @call_logger
     def __call__(self):
-        provider_name = self.agent.rootfs_provider.lower()
-
-        if provider_name:
-            # When a provisioning protocol is specified...
-            provider_module = 'cray.boa.rootfs.{}'.format(provider_name)
-            provider_classname = '{}Provider'.format(provider_name.upper())
-        else:
-            # none specified or blank
-            provider_module = 'cray.boa.rootfs'
-            provider_classname = 'RootfsProvider'
-
-        # Import the Provider's provisioning model
         try:
-            module = importlib.import_module(provider_module)
-        except ModuleNotFoundError as mnfe:
-            # This is pretty much unrecoverable at this stage of development; make note and raise
-            LOGGER.error("Provider provisioning mechanism '{}' not yet implemented or not found.".format(provider_name))
-            raise ProviderNotImplemented(mnfe) from mnfe
-
-        ClassDef = getattr(module, provider_classname)
-        return ClassDef(self.agent)
\ No newline at end of file
+            ClassDef = _REGISTRY[self.provider_name]
+        except KeyError:
+            ClassDef = _REGISTRY.setdefault(self.provider_name, _load_provider_class(self.provider_name))
+        return ClassDef(self.agent)
@@ -27,13 +27,17 @@ Created on February 5th, 2020
 @author: jasons
 '''
 
+import atexit
+from concurrent.futures import Future
+import copy
 import json
 import logging
 import os
+import threading
 
-import boto3
+# boto3 and botocore.config are imported when the first client is created;
+# botocore.exceptions is light and needed for the except clauses below.
 from botocore.exceptions import ClientError
-from botocore.config import Config as BotoConfig
 from urllib.parse import urlparse
 
 from . import TooManyArtifacts, ArtifactMissing, NontransientException
@@ -52,23 +56,21 @@ class S3Url(object):
     https://stackoverflow.com/questions/42641315/s3-urls-get-bucket-name-and-path/42641363
     """
 
+    __slots__ = ('_parsed', 'bucket', 'key', 'url')
+
     def __init__(self, url):
         self._parsed = urlparse(url, allow_fragments=False)
-
-    @property
-    def bucket(self):
-        return self._parsed.netloc
-
-    @property
-    def key(self):
+        # The URL never changes, so split it into its parts up front
+        self.bucket = self._parsed.netloc
         if self._parsed.query:
-            return self._parsed.path.lstrip('/') + '?' + self._parsed.query
+            self.key = self._parsed.path.lstrip('/') + '?' + self._parsed.query
         else:
-            return self._parsed.path.lstrip('/')
+            self.key = self._parsed.path.lstrip('/')
+        self.url = self._parsed.geturl()
 
-    @property
-    def url(self):
-        return self._parsed.geturl()
+
+# (connection_timeout, read_timeout) -> BotoConfig; configs are never modified
+_BOTO_CONFIGS = {}
 
 
 def s3_client(connection_timeout=60, read_timeout=60):
@@ -95,22 +97,67 @@ def s3_client(connection_timeout=60, read_timeout=60):
         LOGGER.error("Missing needed S3 configuration: %s", error)
         raise S3MissingConfiguration(error) from error
 
+    import boto3
+    from botocore.config import Config as BotoConfig
+
+    config_key = (connection_timeout, read_timeout)
+    config = _BOTO_CONFIGS.get(config_key)
+    if config is None:
+        config = _BOTO_CONFIGS.setdefault(config_key, BotoConfig(connect_timeout=connection_timeout,
+                                                                 read_timeout=read_timeout))
+
     s3 = boto3.client('s3',
                       endpoint_url=s3_protocol + "://" + s3_gateway,
                       aws_access_key_id=s3_access_key,
                       aws_secret_access_key=s3_secret_key,
                       use_ssl=False,
                       verify=False,
-                      config=BotoConfig(
-                          connect_timeout=connection_timeout,
-                          read_timeout=read_timeout))
+                      config=config)
     return s3
 
 
+# (connection_timeout, read_timeout) -> s3 client, shared by the whole process
+_S3_CLIENTS = {}
+_S3_CLIENTS_LOCK = threading.Lock()
+
+
+def _get_client(connection_timeout=60, read_timeout=60):
+    """
+    Return an s3 client shared by every caller using the same timeouts. boto3
+    clients are thread safe, and building one is expensive.
+
+    Args and Raises are as for s3_client.
+    """
+    key = (connection_timeout, read_timeout)
+    try:
+        return _S3_CLIENTS[key]
+    except KeyError:
+        pass
+    with _S3_CLIENTS_LOCK:
+        if key not in _S3_CLIENTS:
+            _S3_CLIENTS[key] = s3_client(connection_timeout, read_timeout)
+        return _S3_CLIENTS[key]
+
+
+def _close_clients():
+    with _S3_CLIENTS_LOCK:
+        clients = list(_S3_CLIENTS.values())
+        _S3_CLIENTS.clear()
+    for client in clients:
+        # Client.close() is only available in newer versions of botocore
+        close = getattr(client, 'close', None)
+        if close:
+            close()
+
+
+atexit.register(_close_clients)
+
+
 class S3Object:
     """
     A generic S3 object. It provides a way to download the object.
     """
+    __slots__ = ('path', 'etag', 's3url')
 
     def __init__(self, path, etag=None):
         """
@@ -136,7 +183,7 @@ class S3Object:
         """
 
         try:
-            s3 = s3_client()
+            s3 = _get_client()
             s3_obj = s3.head_object(
                         Bucket=self.s3url.bucket,
                         Key=self.s3url.key
@@ -168,18 +215,24 @@ class S3Object:
           boto3.exceptions.ClientError -- when it cannot read from S3
         """
 
-        s3 = s3_client()
+        s3 = _get_client()
 
         LOGGER.info("++ _get_s3_download_url %s with etag %s.", self.path, self.etag)
         try:
             return s3.get_object(Bucket=self.s3url.bucket, Key=self.s3url.key)
         except ClientError as error:
-            LOGGER.error("Unable to download object {}.".format(self.path))
+            LOGGER.error("Unable to download object %s.", self.path)
             LOGGER.debug(error)
             raise
 
 
+# (path, etag) -> Future for a manifest fetch in flight; shared by every agent thread
+_MANIFEST_FETCHES = {}
+_MANIFEST_FETCHES_LOCK = threading.Lock()
+
+
 class S3BootArtifacts(S3Object):
+    __slots__ = ('_manifest_json', '_artifact_index')
 
     def __init__(self, path, etag=None):
         """
@@ -189,6 +242,7 @@ class S3BootArtifacts(S3Object):
           """
         S3Object.__init__(self, path, etag)
         self._manifest_json = None
+        self._artifact_index = None
 
     @property
     def manifest_json(self):
@@ -209,17 +263,66 @@ class S3BootArtifacts(S3Object):
         if self._manifest_json:
             return self._manifest_json
 
+        # Boot sets frequently share an image; the first agent to ask for a
+        # manifest fetches it and any others asking meanwhile wait for it and
+        # get their own copy. Nothing is kept once the fetch completes.
+        key = (self.path, self.etag)
+        with _MANIFEST_FETCHES_LOCK:
+            fetch = _MANIFEST_FETCHES.get(key)
+            fetching = fetch is None
+            if fetching:
+                fetch = _MANIFEST_FETCHES[key] = Future()
+        if not fetching:
+            self._manifest_json = copy.deepcopy(fetch.result())
+            return self._manifest_json
+        try:
+            self._manifest_json = self._read_manifest()
+            fetch.set_result(self._manifest_json)
+        except BaseException as error:
+            fetch.set_exception(error)
+            raise
+        finally:
+            with _MANIFEST_FETCHES_LOCK:
+                del _MANIFEST_FETCHES[key]
+        return self._manifest_json
+
+    def _read_manifest(self):
+        """
+        Download and parse the manifest.json file.
+
+        Return:
+          Manifest file in JSON format
+        """
+        # NoSuchKey is a subclass of ClientError
         try:
-            s3_manifest_obj = self.object
-            s3_manifest_data = s3_manifest_obj['Body'].read().decode('utf-8')
-        except (ClientError, NoSuchKey) as error:
-            LOGGER.error("Unable to read manifest file {}.".format(self.path))
+            body = self.object['Body']
+            try:
+                s3_manifest_data = body.read()
+            finally:
+                # Hand the connection back to the client's pool
+                body.close()
+        except ClientError as error:
+            LOGGER.error("Unable to read manifest file %s.", self.path)
             LOGGER.debug(error)
             raise
 
-        # Cache the manifest.json file
-        self._manifest_json = json.loads(s3_manifest_data)
-        return self._manifest_json
+        # json detects the encoding of raw bytes
+        return json.loads(s3_manifest_data)
+
+    @property
+    def artifact_index(self):
+        """
+        The manifest's artifacts grouped by type, built on first access.
+
+        Return:
+          A dictionary mapping each artifact type to a list of artifact objects
+        """
+        if self._artifact_index is None:
+            index = {}
+            for artifact in self.manifest_json['artifacts']:
+                index.setdefault(artifact['type'], []).append(artifact)
+            self._artifact_index = index
+        return self._artifact_index
 
     def _get_artifact(self, artifact_type):
         """
@@ -245,8 +348,7 @@ class S3BootArtifacts(S3Object):
           TooManyArtifacts -- There is more than one artifact when only one was expected
         """
         try:
-            artifacts = [artifact for artifact in self.manifest_json['artifacts'] if
-                                 artifact['type'] == artifact_type]
+            artifacts = self.artifact_index.get(artifact_type, ())
         except ValueError as value_error:
             LOGGER.info("Received ValueError while processing manifest file.")
             LOGGER.debug(value_error)
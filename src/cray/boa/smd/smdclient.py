@@ -29,18 +29,27 @@ Created on Apr 26, 2019
 
 from requests.exceptions import HTTPError
 import logging
-import os
+import threading
 from json import JSONDecodeError
 from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from itertools import chain
 
 from cray.boa import PROTOCOL, VERIFY, ServiceNotReady, ServiceError, NontransientException
 from ..sessiontemplate import TemplateException
-from ..connection import requests_retry_session
+from ..connection import shared_session
 from cray.boa.logutil import call_logger
 
 LOGGER = logging.getLogger(__name__)
 SERVICE_NAME = 'cray-smd'
 ENDPOINT = "%s://%s/hsm/v2/" % (PROTOCOL, SERVICE_NAME)
+COMPONENTS_ENDPOINT = '%sState/Components' % (ENDPOINT)
+COMPONENTS_QUERY_ENDPOINT = '%s/Query' % (COMPONENTS_ENDPOINT)
+NODE_MAPS_ENDPOINT = '%sDefaults/NodeMaps' % (ENDPOINT)
+
+# The node states HSM reports, in the order used for messages
+ALLOWABLE_STATES = ("Unknown", "Empty", "Populated", "Off", "On", "Standby", "Halt", "Ready")
+_ALLOWABLE_STATE_SET = frozenset(ALLOWABLE_STATES)
 
 
 @call_logger
@@ -57,8 +66,8 @@ def node_map(key, node_list, session=None):
                           specified for the key; eg. If the key is an xname,
                           then the node_list should all be xnames
         session (object): Allows specifying an existing Requests session to use,
-                          otherwise, creates a new session object with built in
-                          retry resilience.
+                          otherwise, uses the process-wide shared session with
+                          built in retry resilience.
 
     Returns:
         A node map (i.e. a dictionary) based on the specified key
@@ -71,7 +80,7 @@ def node_map(key, node_list, session=None):
                                          communicating with the
                                          Hardware State Manager
     '''
-    session = session or requests_retry_session()
+    session = session or shared_session()
     if key.lower() not in ["xname", "nid"]:
         msg = "Invalid key value: %s; Must be xname or nid" % key
         LOGGER.error(msg)
@@ -82,9 +91,8 @@ def node_map(key, node_list, session=None):
     else:
         map_key = "ID"
         map_value = "NID"
-    url = '%s/Defaults/NodeMaps' % (ENDPOINT)
     try:
-        resp = session.get(url)
+        resp = session.get(NODE_MAPS_ENDPOINT)
         resp.raise_for_status()
     except HTTPError as err:
         LOGGER.error("Failed while interacting with the Hardware State Manager: %s", err)
@@ -100,9 +108,7 @@ def node_map(key, node_list, session=None):
         LOGGER.error("Expected key 'NodeMaps' was not in response data: %s", err)
         raise ServiceError(err) from err
 
-    node_dict = {}
-    for node in node_maps:
-        node_dict[node[map_key]] = node[map_value]
+    node_dict = {node[map_key]: node[map_value] for node in node_maps}
 
     if len(node_list):
         filtered_node_dict = { node: node_dict[node] for node in node_list }
@@ -125,13 +131,22 @@ def filter_split(node_list):
     * disabled
     * empty
     """
-    enabled = set(filter_nodes_by_enabled(node_list[:], True))
+    components = get_bulk_nodes_info(node_list)
+    enabled = {component['ID'] for component in components if component['Enabled']}
+    # Nodes unknown to HSM are not enabled either
     disabled = set(node_list) - enabled
-    empty = set(filter_nodes_by_empty(node_list))
+    empty = {component['ID'] for component in components if component['State'] == 'Empty'}
     return list(enabled), list(disabled), list(empty)
 
-cached_node_info = None
-cached_node_set = set()
+# Component queries for more nodes than this are split into chunks of this size,
+# up to QUERY_WORKERS of which are issued at once
+QUERY_CHUNK_SIZE = 500
+QUERY_WORKERS = 8
+
+# (requested nodes, components) from the last successful query,
+# for get_bulk_nodes_info(use_cached=True)
+_CACHED_NODE_INFO = None
+
 
 def get_bulk_nodes_info(nodes, use_cached=False, session=None):
     """
@@ -141,38 +156,142 @@ def get_bulk_nodes_info(nodes, use_cached=False, session=None):
       nodes -- A collection of nodes (iterable) xname form
 
     Returns:
-      A dictionary containing the nodes' states; If use_cached==True, this will return
-      a cached value so long as the nodes in the node list match those in the cached list.
+      A list containing the nodes' components; If use_cached==True, this will return
+      copies of the components from the last query so long as every node in the node
+      list was part of it.
 
     Raises:
       HTTPError
     """
-    global cached_node_info
-    session = session or requests_retry_session()
-    if use_cached and cached_node_info:
+    global _CACHED_NODE_INFO
+    session = session or shared_session()
+    nodes = list(nodes)
+    cached = _CACHED_NODE_INFO
+    if use_cached and cached:
         node_list_set = set(nodes)
-        if node_list_set <= cached_node_set:
-            return cached_node_info
+        cached_nodes, cached_components = cached
+        if node_list_set.issubset(cached_nodes):
+            return [dict(component) for component in cached_components
+                    if component['ID'] in node_list_set]
         else:
             LOGGER.warning("Node list contained nodes not in cached node list. "
                            "Not using cache.  Requesting fresh state instead.")
+    if len(nodes) <= QUERY_CHUNK_SIZE:
+        components = _query_components(nodes, session)
+    else:
+        # Large node lists are split into chunks that HSM answers in parallel
+        chunks = [nodes[i:i + QUERY_CHUNK_SIZE] for i in range(0, len(nodes), QUERY_CHUNK_SIZE)]
+        with ThreadPoolExecutor(max_workers=min(QUERY_WORKERS, len(chunks))) as executor:
+            results = list(executor.map(lambda chunk: _query_components(chunk, session), chunks))
+        if any(result is None for result in results):
+            components = None
+        else:
+            components = list(chain.from_iterable(results))
+    if components is not None:
+        _CACHED_NODE_INFO = (nodes, components)
+    return components
+
+
+def _query_components(nodes, session):
+    """
+    Query HSM for the components of <nodes>.
+
+    Returns:
+      A list of components, or None if the query failed
+    """
     try:
-        endpoint = os.path.join(ENDPOINT, 'State/Components/Query')
-        payload = {'ComponentIDs': list(nodes)}
-        response = session.post(endpoint, verify=VERIFY, json=payload)
+        payload = {'ComponentIDs': nodes}
+        response = session.post(COMPONENTS_QUERY_ENDPOINT, verify=VERIFY, json=payload)
         if not response.ok:
             LOGGER.error("'%s' did not respond appropriately: %s",
-                         endpoint, response.text)
+                         COMPONENTS_QUERY_ENDPOINT, response.text)
             try:
                 raise response.raise_for_status()
             except HTTPError as hpe:
                 raise ServiceNotReady(hpe) from hpe
-        cached_node_info = response.json()['Components']
-        return cached_node_info
+        return response.json()['Components']
     except (HTTPError) as exception:
         LOGGER.error("Unable to determine nodes' states: %s", exception)
         return None
 
+class BulkStateFetcher(object):
+    """
+    Coalesces concurrent get_bulk_nodes_info calls made with the same session.
+    A call made while no query is in flight for its session issues its query
+    immediately. Calls made while one is in flight add their nodes to a single
+    pending batch; the first of them issues one query for the union of the nodes
+    as soon as the in-flight query completes, and every caller receives its own
+    nodes' components from that response.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # session -> Future of {ID: component} or None, for the query in flight
+        self._in_flight = {}
+        # session -> (set of nodes, Future of {ID: component} or None), waiting
+        # on the query in flight
+        self._pending = {}
+
+    def __call__(self, nodes, session=None):
+        """
+        Args:
+          nodes -- A collection of nodes (iterable) in xname form
+          session -- Session used to query HSM
+
+        Returns:
+          The components for <nodes>, as get_bulk_nodes_info, or None if the
+          query failed
+        """
+        nodes = set(nodes)
+        with self._lock:
+            in_flight = self._in_flight.get(session)
+            if in_flight is None:
+                batch_nodes = nodes
+                result = self._in_flight[session] = Future()
+                issuer = True
+            elif session in self._pending:
+                batch_nodes, result = self._pending[session]
+                batch_nodes |= nodes
+                issuer = False
+            else:
+                batch_nodes, result = self._pending[session] = (set(nodes), Future())
+                issuer = True
+        if issuer:
+            if in_flight is not None:
+                wait((in_flight,))
+            try:
+                components = get_bulk_nodes_info(batch_nodes, session=session)
+            except BaseException as exc:
+                self._finish(session)
+                result.set_exception(exc)
+                raise
+            self._finish(session)
+            if components is None:
+                result.set_result(None)
+            else:
+                result.set_result({component['ID']: component for component in components})
+        by_id = result.result()
+        if by_id is None:
+            return None
+        return [by_id[node] for node in nodes if node in by_id]
+
+    def _finish(self, session):
+        """
+        Mark the query in flight for <session> as done; the pending batch, if
+        there is one, becomes the query in flight. Its nodes must be final
+        before the completed query's result is published.
+        """
+        with self._lock:
+            pending = self._pending.pop(session, None)
+            if pending is None:
+                del self._in_flight[session]
+            else:
+                self._in_flight[session] = pending[1]
+
+
+_BULK_STATE_FETCHER = BulkStateFetcher()
+
+
 def filter_nodes_by_state(state, node_list, invert=False, session=None):
     """
     Check the state of nodes in the node list.  Return only those nodes that
@@ -193,22 +312,17 @@ def filter_nodes_by_state(state, node_list, invert=False, session=None):
     Raises:
       HTTPError
     """
-    session = session or requests_retry_session()
-    matching = set()
-    allowable_states = ["Unknown", "Empty", "Populated", "Off", "On", "Standby", "Halt", "Ready"]
-    if state not in allowable_states:
-        msg = "State '%s' not in allowed states: %s" % (state, ",".join(allowable_states))
+    session = session or shared_session()
+    if state not in _ALLOWABLE_STATE_SET:
+        msg = "State '%s' not in allowed states: %s" % (state, ",".join(ALLOWABLE_STATES))
         LOGGER.error(msg)
         raise NontransientException(msg)
-    node_states = get_bulk_nodes_info(node_list, session=session)
-    if node_states:
-        if not invert:
-            matching_states = list(filter(lambda node: node['State'] == state, node_states))
-        else:
-            matching_states = list(filter(lambda node: node['State'] != state, node_states))
-
-        matching |= {n['ID'] for n in matching_states}
-    return matching
+    node_states = _BULK_STATE_FETCHER(node_list, session=session)
+    if not node_states:
+        return set()
+    if not invert:
+        return {n['ID'] for n in node_states if n['State'] == state}
+    return {n['ID'] for n in node_states if n['State'] != state}
 
 def filter_nodes_by_enabled(node_list, enabled=True, session=None):
     """
@@ -228,16 +342,13 @@ def filter_nodes_by_enabled(node_list, enabled=True, session=None):
     Raises:
       HTTPError
     """
-    session = session or requests_retry_session()
-    matching = set()
+    session = session or shared_session()
     if not isinstance(enabled, bool):
         msg = "enabled must be boolean."
         LOGGER.error(msg)
         raise NontransientException(msg)
     node_states = get_bulk_nodes_info(node_list, session=session)
-    matching_states = list(filter(lambda node: node['Enabled'] == enabled, node_states))
-    matching |= {n['ID'] for n in matching_states}
-    return matching
+    return {n['ID'] for n in node_states if n['Enabled'] == enabled}
 
 
 def component_id_query(session=None, **kwargs):
@@ -245,13 +356,12 @@ def component_id_query(session=None, **kwargs):
     Queries SMD for all component xnames by a given <role>.
     Returns a set of xnames that correspond to <role>.
     '''
-    endpoint = os.path.join(ENDPOINT, 'State/Components')
-    session = session or requests_retry_session()
-    response = session.get(endpoint, params=kwargs, verify=VERIFY)
+    session = session or shared_session()
+    response = session.get(COMPONENTS_ENDPOINT, params=kwargs, verify=VERIFY)
     try:
         response.raise_for_status()
     except HTTPError as hpe:
-        LOGGER.error("Failed to resolve component id: '%s': %s", endpoint, hpe)
+        LOGGER.error("Failed to resolve component id: '%s': %s", COMPONENTS_ENDPOINT, hpe)
         if response.status_code == 400:
             # In this case, its possible that the query terms in
             # kwargs are not valid. These are returned to the user
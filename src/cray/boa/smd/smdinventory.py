@@ -22,13 +22,14 @@
 # OTHER DEALINGS IN THE SOFTWARE.
 #
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 from requests.exceptions import HTTPError
 import logging
-import os
 
 from ..logutil import call_logger
 from . import ENDPOINT as HSM_ENDPOINT
-from ..connection import requests_retry_session
+from ..connection import shared_session
 from cray.boa import VERIFY
 
 LOGGER = logging.getLogger(__name__)
@@ -46,50 +47,47 @@ class SMDInventory(object):
     def __init__(self, partition=None):
         self._partition = partition  # Can be specified to limit to roles/components query
 
-    @property
+    @cached_property
     def groups(self):
-        if not hasattr(self, '_groups'):
-            data = self.get('groups')
-            groups = {}
-            for group in data:
-                groups[group['label']] = set(group.get('members', {}).get('ids', []))
-            self._groups = groups
-        return self._groups
+        data = self.get('groups')
+        groups = {}
+        for group in data:
+            groups[group['label']] = set(group.get('members', {}).get('ids', []))
+        return groups
 
-    @property
+    @cached_property
     def partitions(self):
-        if not hasattr(self, '_partitions'):
-            data = self.get('partitions')
-            partitions = {}
-            for partition in data:
-                partitions[partition['name']] = set(partition.get('members', {}).get('ids', []))
-            self._partitions = partitions
-        return self._partitions
+        data = self.get('partitions')
+        partitions = {}
+        for partition in data:
+            partitions[partition['name']] = set(partition.get('members', {}).get('ids', []))
+        return partitions
 
-    @property
+    @cached_property
     def roles(self):
-        if not hasattr(self, '_roles'):
-            params = {}
-            if self._partition:
-                params['partition'] = self._partition
-            data = self.get('State/Components', params=params)
-            roles = defaultdict(set)
-            for component in data['Components']:
-                if 'Role' in component:
-                    roles[component['Role']].add(component['ID'])
-            self._roles = roles
-        return self._roles
+        params = {}
+        if self._partition:
+            params['partition'] = self._partition
+        data = self.get('State/Components', params=params)
+        roles = defaultdict(set)
+        for component in data['Components']:
+            if 'Role' in component:
+                roles[component['Role']].add(component['ID'])
+        return roles
 
-    @property
+    @cached_property
     def inventory(self):
-        if not hasattr(self, '_inventory'):
-            inventory = {}
-            inventory.update(self.groups)
-            inventory.update(self.partitions)
-            inventory.update(self.roles)
-            self._inventory = inventory
-            LOGGER.info(self._inventory)
-        return self._inventory
+        # The three HSM queries are independent; issue them concurrently
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            groups = executor.submit(lambda: self.groups)
+            partitions = executor.submit(lambda: self.partitions)
+            roles = executor.submit(lambda: self.roles)
+        inventory = {}
+        inventory.update(groups.result())
+        inventory.update(partitions.result())
+        inventory.update(roles.result())
+        LOGGER.info(inventory)
+        return inventory
 
     def __contains__(self, key):
         return key in self.inventory
@@ -98,10 +96,10 @@ class SMDInventory(object):
         return self.inventory[key]
 
     @call_logger
-    def get(self, path, params={}):
-        url = os.path.join(HSM_ENDPOINT, path)
+    def get(self, path, params=None):
+        url = '%s%s' % (HSM_ENDPOINT, path)
         if not hasattr(self, '_session'):
-            self._session = requests_retry_session()
+            self._session = shared_session()
         try:
             response = self._session.get(url, params=params, verify=VERIFY)
             response.raise_for_status()
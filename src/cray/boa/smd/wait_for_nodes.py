@@ -21,14 +21,32 @@
 # ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 # OTHER DEALINGS IN THE SOFTWARE.
 #
+import heapq
 import logging
+import random
 import time
 
 from .smdclient import filter_nodes_by_state, node_state_summary
-from ..connection import requests_retry_session
+from ..connection import shared_session
 from cray.boa import TransientException
 
 LOGGER = logging.getLogger(__name__)
+# Nodes are polled at the caller's interval while they are changing state; polling
+# backs off by BACKOFF_FACTOR per idle poll up to MAX_SLEEP_TIME seconds when they are not
+BACKOFF_FACTOR = 1.5
+MAX_SLEEP_TIME = 15
+# Nodes already in the awaited state are only rechecked every this many polls
+REVALIDATE_EVERY = 5
+# wait_for_nodes refreshes its node state summary at least every this many polls
+SUMMARY_REFRESH_EVERY = 10
+# wait_for_state repeats an unchanged status message at most this often (seconds)
+STATUS_REPORT_INTERVAL = 15
+# How the polling loops wait; tests replace this to avoid real sleeps
+_SLEEP = time.sleep
+# wait_for_nodes reports arriving nodes to BOS once this many are pending, or when
+# this many seconds have passed since its last report
+STATUS_BATCH_SIZE = 50
+STATUS_BATCH_INTERVAL = 10
 
 
 class NodeStateMismatch(TransientException):
@@ -46,7 +64,35 @@ class NodesNotReady(TransientException):
     """
 
 
+def _next_delay(prev, base, cap, floor):
+    """
+    Return the polling delay that follows <prev> when nothing has changed:
+    <prev> grown by <base>, kept between <floor> and <cap>.
+    """
+    return min(cap, max(floor, prev * base))
+
+
+def _poll_nodes(state, node_list, node_set, matched, polls, revalidate_every, invert, session,
+                confirm=False):
+    """
+    Return the nodes in <node_set> that are in <state> (or not in it, if <invert>);
+    <node_list> holds the same nodes as a list.
+    Nodes that already <matched> are assumed to still match and are not queried,
+    except on every <revalidate_every>th poll, when the whole set is checked again.
+    The whole set is also checked when <confirm> is set, and before every node is
+    reported as matching, since a node may have left the state since it matched.
+    """
+    if confirm or not matched or polls % revalidate_every == 0:
+        return filter_nodes_by_state(state, node_list, invert, session)
+    matching = matched | filter_nodes_by_state(state, list(node_set - matched), invert, session)
+    if matching == node_set:
+        return filter_nodes_by_state(state, node_list, invert, session)
+    return matching
+
+
 def wait_for_nodes(boot_set_agent, state, invert=False, sleep_time=60, allowed_retries=-1,
+                   poll_backoff_base=BACKOFF_FACTOR, poll_backoff_max=MAX_SLEEP_TIME,
+                   revalidate_every=REVALIDATE_EVERY, summary_refresh_every=SUMMARY_REFRESH_EVERY,
                    **status):
     """
     Waits for all nodes to be in the <state> state.
@@ -58,9 +104,19 @@ def wait_for_nodes(boot_set_agent, state, invert=False, sleep_time=60, allowed_r
                    not in this state if invert = True
       invert (binary): False -- Wait for all of the nodes to be in the input state
                        True -- Wait for all of the nodes to not be in the input state
-      sleep_time (int): Number of seconds to sleep before rechecking nodes' states
-      allowed_retries (int): Number of times to check that all nodes are ready;
-                             if negative, no limits on retries are imposed
+      sleep_time (int): Number of seconds to sleep before rechecking nodes' states while
+                        they are changing state; polling backs off from this up to
+                        poll_backoff_max while no nodes change state
+      allowed_retries (int): Number of sleep_time periods to wait for all nodes to be ready;
+                             this is measured in elapsed time, so longer sleeps while polling
+                             is backed off count for more than one. If negative, no limits
+                             on retries are imposed
+      poll_backoff_base (float): Factor the polling delay grows by while no nodes change state
+      poll_backoff_max (float): Longest polling delay (seconds) while no nodes change state
+      revalidate_every (int): Nodes found in the awaited state are only queried again
+                              on every this many polls
+      summary_refresh_every (int): While the matching nodes are unchanged, the node state
+                                   summary is only refreshed every this many polls
       status (keywords, dict): These parameters are for reporting status. They are optional otherwise.
         boot_set (str): The Boot Set we are reporting status for
         phase (str): The Phase we are reporting status for
@@ -73,66 +129,147 @@ def wait_for_nodes(boot_set_agent, state, invert=False, sleep_time=60, allowed_r
       NodesNotReady (exception): If we reach a time-out stage, then it raises a
                                   NodesNotReady exception
     """
+    node_set = set(boot_set_agent.nodes)
+    if not node_set:
+        return
     session = boot_set_agent.smd_client
-    num_retries = 0
+    polls = 0
     matching_nodes = None
-    node_set = set(boot_set_agent.nodes)
+    node_list = list(node_set)
     summary = None
+    last_matching_nodes = None
+    floor = sleep_time
+    cap = max(sleep_time, poll_backoff_max)
+    delay = floor
+    start = time.monotonic()
+    # When the retries run out; the final poll is made then
+    retries_end = start + (allowed_retries + 1) * sleep_time
+    # Set once a sleep has been cut short to end at retries_end
+    reached_retries_end = False
     if status:
         previously_matching_nodes = set()
-    while matching_nodes != node_set:
-        matching_nodes = set(filter_nodes_by_state(state, list(node_set), invert, session))
-        not_matching_nodes = node_set - matching_nodes
-        number_not_matching = len(not_matching_nodes)
-        # Report status
-        if status:
-            new_matching_nodes = set(matching_nodes) - previously_matching_nodes
-            if new_matching_nodes:
-                boot_set_agent.boot_set_status.move_nodes(new_matching_nodes,
-                                                          status['phase'],
-                                                          status['source'],
-                                                          status['destination'])
-            previously_matching_nodes = set(matching_nodes)
-        if (allowed_retries > 0) and (num_retries > allowed_retries):
-            msg = ("Number of retries: {} exceeded allowed amount: {}; "
-                   "{} nodes were {} in the state: {}".format(
-                   num_retries, allowed_retries, number_not_matching,
-                   "not" if not invert else "still ",
-                   state))
-            LOGGER.error(msg)
-            LOGGER.debug("These nodes were %s in the state: %s \n%s",
-                         "not" if not invert else "still ",
-                         state,
-                         "\n".join(node_set - matching_nodes))
-            # Update the nodes which failed boot based on expended retries
-            boot_set_agent.boot_set_status.move_nodes(not_matching_nodes,
+        unreported_nodes = set()
+        last_report = time.monotonic()
+
+    def report_arrivals():
+        """
+        Move the nodes that have arrived since the last report to the destination.
+        """
+        nonlocal unreported_nodes, last_report
+        if unreported_nodes:
+            boot_set_agent.boot_set_status.move_nodes(unreported_nodes,
                                                       status['phase'],
                                                       status['source'],
-                                                      'failed')
-            boot_set_agent.failed_nodes |= not_matching_nodes
-            if boot_set_agent.nodes:
-                # If there are nodes that have arrived in the preferred state,
-                # let them continue.
-                return
+                                                      status['destination'])
+            unreported_nodes = set()
+        last_report = time.monotonic()
+
+    try:
+        while matching_nodes != node_set:
+            if sleep_time:
+                # Retries are counted in sleep_time periods of elapsed time, jitter and
+                # backed off sleeps included, so that they bound the overall wait.
+                # Compare against the clock rather than a truncated retry count, which
+                # can fall just short after sleeping until retries_end.
+                now = time.monotonic()
+                num_retries = int((now - start) // sleep_time)
+                out_of_retries = allowed_retries > 0 and (reached_retries_end
+                                                          or now >= retries_end)
             else:
-                raise NodesNotReady(msg)
-        num_retries += 1
-        new_summary = node_state_summary(node_set)
-        if summary != new_summary:
-            # In this case, we have updated information about the system state
-            # that we can relay back to the user; do so
-            summary = new_summary
-            LOGGER.info('\n%s', summary)
-        if number_not_matching:
-            LOGGER.info("Waiting %d seconds for %d node%s to %sbe in state: %s",
-                        sleep_time, number_not_matching,
-                        "s" if number_not_matching > 1 else "",
-                        "" if not invert else "not ", state)
-            time.sleep(sleep_time)
+                num_retries = polls
+                out_of_retries = allowed_retries > 0 and num_retries > allowed_retries
+            # The poll that exhausts the retries decides which nodes failed; use fresh states
+            matching_nodes = _poll_nodes(state, node_list, node_set, matching_nodes, polls,
+                                         revalidate_every, invert, session,
+                                         confirm=out_of_retries)
+            polls += 1
+            not_matching_nodes = node_set - matching_nodes
+            number_not_matching = len(not_matching_nodes)
+            # Report status
+            if status:
+                new_matching_nodes = matching_nodes - previously_matching_nodes
+                unreported_nodes |= new_matching_nodes
+                previously_matching_nodes |= new_matching_nodes
+                # Nodes are moved in batches rather than on every poll that sees some arrive
+                if unreported_nodes and (
+                        len(unreported_nodes) >= STATUS_BATCH_SIZE
+                        or time.monotonic() - last_report >= STATUS_BATCH_INTERVAL):
+                    report_arrivals()
+            if out_of_retries:
+                msg = ("Number of retries: {} exceeded allowed amount: {}; "
+                       "{} nodes were {} in the state: {}".format(
+                       num_retries, allowed_retries, number_not_matching,
+                       "not" if not invert else "still ",
+                       state))
+                LOGGER.error(msg)
+                if LOGGER.isEnabledFor(logging.DEBUG):
+                    LOGGER.debug("These nodes were %s in the state: %s \n%s",
+                                 "not" if not invert else "still ",
+                                 state,
+                                 "\n".join(not_matching_nodes))
+                if status:
+                    report_arrivals()
+                # Update the nodes which failed boot based on expended retries
+                boot_set_agent.boot_set_status.move_nodes(not_matching_nodes,
+                                                          status['phase'],
+                                                          status['source'],
+                                                          'failed')
+                boot_set_agent.failed_nodes |= not_matching_nodes
+                if boot_set_agent.nodes:
+                    # If there are nodes that have arrived in the preferred state,
+                    # let them continue.
+                    return
+                else:
+                    raise NodesNotReady(msg)
+            # The full state summary costs another HSM query; only ask for it when it
+            # would be logged and the matching nodes changed, or every so often to
+            # catch other transitions
+            if LOGGER.isEnabledFor(logging.INFO) and (
+                    matching_nodes != last_matching_nodes or not number_not_matching
+                    or polls % summary_refresh_every == 0):
+                new_summary = node_state_summary(node_set)
+                if summary != new_summary:
+                    # In this case, we have updated information about the system state
+                    # that we can relay back to the user; do so
+                    summary = new_summary
+                    LOGGER.info('\n%s', summary)
+            if number_not_matching:
+                if matching_nodes != last_matching_nodes:
+                    # Progress; check back soon
+                    delay = floor
+                else:
+                    delay = _next_delay(delay, poll_backoff_base, cap, floor)
+                last_matching_nodes = matching_nodes
+                # Jitter keeps concurrent boot sets from polling HSM in lockstep
+                wait = delay + random.uniform(0, 1)
+                if allowed_retries > 0 and sleep_time:
+                    # Don't sleep past the end of the retries; the poll after such a
+                    # sleep is the last
+                    remaining = max(0, retries_end - time.monotonic())
+                    if wait >= remaining:
+                        wait = remaining
+                        reached_retries_end = True
+                LOGGER.info("Waiting %d seconds for %d node%s to %sbe in state: %s",
+                            wait, number_not_matching,
+                            "s" if number_not_matching > 1 else "",
+                            "" if not invert else "not ", state)
+                _SLEEP(wait)
+    except BaseException:
+        # Report the nodes that arrived before the failure; failing to do so must
+        # not hide the original error
+        if status:
+            try:
+                report_arrivals()
+            except Exception:
+                LOGGER.exception("Unable to report the nodes that reached state %s", state)
+        raise
+    if status:
+        report_arrivals()
 
 
 def wait_for_state(nodes, state, duration=70, interval=5, session=None, invert=False,
-                   success_threshold=1.0):
+                   success_threshold=1.0, poll_backoff_base=BACKOFF_FACTOR,
+                   poll_backoff_max=MAX_SLEEP_TIME, revalidate_every=REVALIDATE_EVERY):
     """
     Waits up to <duration> seconds for <nodes> to enter <state>, or alternatively,
     for nodes to not be in <state> when <invert> is true. Re-uses a passed in
@@ -147,9 +284,13 @@ def wait_for_state(nodes, state, duration=70, interval=5, session=None, invert=F
         nodes: The set of nodes to obtain state from
         state: the string value of the state of interest
         duration: The total length of time to wait for nodes to enter or exit state
-        interval: How frequently we check state (seconds)
+        interval: The time between checks of state (seconds) while nodes are changing
+            state; checks back off from this up to poll_backoff_max while they are not
         session: A requests session
         invert: Invert the selection critieria to NOT be equal to <state>.
+        poll_backoff_base: Factor the delay between checks grows by while no nodes change state
+        poll_backoff_max: Longest delay between checks (seconds) while no nodes change state
+        revalidate_every: Nodes found in <state> are only checked again every this many polls
     Side Effects:
         - This function logs information periodically, so as to give feedback to users
     Raises:
@@ -160,42 +301,64 @@ def wait_for_state(nodes, state, duration=70, interval=5, session=None, invert=F
         calling functions to further reduce the set of nodes to operate on as
         a threshold mechanism for partial success.
     """
-    session = session or requests_retry_session()
+    if not nodes:
+        return set()
+    session = session or shared_session()
     node_count = len(nodes)
     desired_state = "not %s" % (state) if invert else state
-    node_list = list(nodes)
-    node_set = set(nodes)
-    end_time = time.time() + duration
+    # <nodes> is only read, so a set is used as is
+    node_set = nodes if isinstance(nodes, (set, frozenset)) else set(nodes)
+    node_list = list(node_set)
+    end_time = time.monotonic() + duration
     acceptable_failed_nodes = (1.0 - success_threshold) * node_count
     minimum_required_success = node_count - acceptable_failed_nodes
-    last_status_msg = None
-    last_status_report = time.time()
-    while time.time() < end_time:
-        nodes_in_state = set(filter_nodes_by_state(state, node_list, invert=invert, session=session))
+    last_reported_count = None
+    last_status_report = time.monotonic()
+    nodes_in_state = set()
+    state_mismatch = set(node_set)
+    mismatch_count = node_count
+    last_nodes_in_state = None
+    polls = 0
+    floor = interval
+    cap = max(interval, poll_backoff_max)
+    delay = floor
+    while time.monotonic() < end_time:
+        nodes_in_state = _poll_nodes(state, node_list, node_set, nodes_in_state, polls,
+                                     revalidate_every, invert, session)
+        polls += 1
         if nodes_in_state == node_set:
             LOGGER.info("All nodes now in desired state (%s).", desired_state)
             return set()
         state_mismatch = node_set - nodes_in_state
         mismatch_count = len(state_mismatch)
-        new_status_msg = 'Waiting on %s nodes to be %s' % (mismatch_count, desired_state)
-        if new_status_msg != last_status_msg or last_status_report + 15 > time.time():
-            LOGGER.info(new_status_msg)
-            last_status_msg = new_status_msg
-            last_status_report = time.time()
-        # Wait for the interval to expire
-        time.sleep(interval)
+        now = time.monotonic()
+        if (mismatch_count != last_reported_count
+                or now - last_status_report >= STATUS_REPORT_INTERVAL):
+            LOGGER.info('Waiting on %s nodes to be %s', mismatch_count, desired_state)
+            last_reported_count = mismatch_count
+            last_status_report = now
+        if nodes_in_state != last_nodes_in_state:
+            delay = floor
+        else:
+            delay = _next_delay(delay, poll_backoff_base, cap, floor)
+        last_nodes_in_state = nodes_in_state
+        # Don't sleep past the end of the wait; the final check follows it
+        _SLEEP(max(0, min(delay, end_time - now)))
     # We're out of time! Evaluate if we have enough nodes in the desired
-    # state to continue
+    # state to continue, from the states of all of them rather than the ones
+    # last polled
+    if polls:
+        nodes_in_state = filter_nodes_by_state(state, node_list, invert, session)
+        state_mismatch = node_set - nodes_in_state
+        mismatch_count = len(state_mismatch)
     nodecount_in_desired_state = len(nodes_in_state)
     LOGGER.info("Wait for state period has finished; %s nodes in desired state, %s nodes are not in desired state.",
                 nodecount_in_desired_state, mismatch_count)
     # Output at least a few nodes that are not ready
-    if mismatch_count <= 5:
-        LOGGER.warning("%s nodes failed to enter state '%s': %s",
-                       mismatch_count, desired_state, ', '.join(sorted(state_mismatch)[:5]))
-    else:
-        LOGGER.warning("%s nodes failed to enter state '%s'; %s..." ,
-                       mismatch_count, desired_state, ', '.join(sorted(state_mismatch)[:5]))
+    LOGGER.warning("%s nodes failed to enter state '%s': %s%s",
+                   mismatch_count, desired_state,
+                   ', '.join(heapq.nsmallest(5, state_mismatch)),
+                   '...' if mismatch_count > 5 else '')
     if nodecount_in_desired_state >= minimum_required_success:
         return state_mismatch
     else:
@@ -211,5 +374,7 @@ def ready_drain(nodes, duration=70, interval=5, session=None):
     Wait for nodes to exit the ready state. This is an ease of use call
     to the wait_for_state function, which is timeboxed.
     """
-    session = session or requests_retry_session()
+    if not nodes:
+        return set()
+    session = session or shared_session()
     return wait_for_state(nodes, 'Ready', duration=duration, interval=interval, invert=True, session=session)
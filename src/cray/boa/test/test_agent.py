@@ -38,46 +38,52 @@ from cray.boa.agent import BootSetAgent
 LOGGER = logging.getLogger(__name__)
 
 
+# The session template written out for every test in TestAgent
+_TEMPLATE = {"boot_sets": {
+    "nid1": {
+        "etag": "1ad2687fa9320a7358f117934527c29b",
+        "kernel_parameters": "console=ttyS0,115200 bad_page=panic crashkernel=256M hugepagelist=2m-2g intel_iommu=off intel_pstate=disable iommu=pt ip=dhcp numa_interleave_omit=headless numa_zonelist_order=node oops=panic pageblock_order=14 pcie_ports=native printk.synchronous=y rd.neednet=1 rd.retry=10 rd.shell k8s_gw=api-gw-service-nmn.local quiet turbo_boost_limit=999 biosdevname=0", "name": "nid3", "network": "nmn",
+        "node_list": ["x3000c0s19b3n0"],
+        "path": "s3://boot-images/73ad471b-5cb1-4f55-9a73-c1c145058800/manifest.json",
+        "rootfs_provider": "cpss3",
+        "rootfs_provider_passthrough": "dvs:api-gw-service-nmn.local:300:eth0",
+        "type": "s3"},
+    "Computes": {
+        "etag": "1ad2687fa9320a7358f117934527c29b",
+        "kernel_parameters": "console=ttyS0,115200 bad_page=panic crashkernel=256M hugepagelist=2m-2g intel_iommu=off intel_pstate=disable iommu=pt ip=dhcp numa_interleave_omit=headless numa_zonelist_order=node oops=panic pageblock_order=14 pcie_ports=native printk.synchronous=y rd.neednet=1 rd.retry=10 rd.shell k8s_gw=api-gw-service-nmn.local quiet turbo_boost_limit=999 biosdevname=0", "name": "nid3", "network": "nmn",
+        "path": "s3://boot-images/73ad471b-5cb1-4f55-9a73-c1c145058800/manifest.json",
+        "rootfs_provider": "cpss3",
+        "rootfs_provider_passthrough": "dvs:api-gw-service-nmn.local:300:eth0",
+        "type": "s3",
+        "node_roles_groups": ["Computes"]},
+    "RandyBitCoinMiner": {
+        "etag": "1ad2687fa9320a7358f117934527c29b",
+        "kernel_parameters": "console=ttyS0,115200 bad_page=panic crashkernel=256M hugepagelist=2m-2g intel_iommu=off intel_pstate=disable iommu=pt ip=dhcp numa_interleave_omit=headless numa_zonelist_order=node oops=panic pageblock_order=14 pcie_ports=native printk.synchronous=y rd.neednet=1 rd.retry=10 rd.shell k8s_gw=api-gw-service-nmn.local quiet turbo_boost_limit=999 biosdevname=0", "name": "nid3", "network": "nmn",
+        "path": "s3://boot-images/73ad471b-5cb1-4f55-9a73-c1c145058800/manifest.json",
+        "rootfs_provider": "cpss3",
+        "rootfs_provider_passthrough": "dvs:api-gw-service-nmn.local:300:eth0",
+        "type": "s3",
+        "node_groups": ["ThisOne", "ThatOne", "TheOtherOne"]},
+    },
+    "cfs": {"branch": "master", "clone_url": "https://api-gw-service-nmn.local/vcs/cray/config-management.git"},
+    "description": "BOS session template for booting compute nodes, generated by the installation",
+    "enable_cfs": True,
+    "name": "unittest_sessiontemplate"}
+_TEMPLATE_JSON = json.dumps(_TEMPLATE)
+
+
 class TestAgent(unittest.TestCase):
 
-    def setUp(self):
-        # Write a file representing a session
-        self.file_path = tempfile.NamedTemporaryFile(delete=True).name
-        obj = {"boot_sets": {
-                "nid1": {
-                    "etag": "1ad2687fa9320a7358f117934527c29b",
-                    "kernel_parameters": "console=ttyS0,115200 bad_page=panic crashkernel=256M hugepagelist=2m-2g intel_iommu=off intel_pstate=disable iommu=pt ip=dhcp numa_interleave_omit=headless numa_zonelist_order=node oops=panic pageblock_order=14 pcie_ports=native printk.synchronous=y rd.neednet=1 rd.retry=10 rd.shell k8s_gw=api-gw-service-nmn.local quiet turbo_boost_limit=999 biosdevname=0", "name": "nid3", "network": "nmn",
-                    "node_list": ["x3000c0s19b3n0"],
-                    "path": "s3://boot-images/73ad471b-5cb1-4f55-9a73-c1c145058800/manifest.json",
-                    "rootfs_provider": "cpss3",
-                    "rootfs_provider_passthrough": "dvs:api-gw-service-nmn.local:300:eth0",
-                    "type": "s3"},
-                "Computes": {
-                    "etag": "1ad2687fa9320a7358f117934527c29b",
-                    "kernel_parameters": "console=ttyS0,115200 bad_page=panic crashkernel=256M hugepagelist=2m-2g intel_iommu=off intel_pstate=disable iommu=pt ip=dhcp numa_interleave_omit=headless numa_zonelist_order=node oops=panic pageblock_order=14 pcie_ports=native printk.synchronous=y rd.neednet=1 rd.retry=10 rd.shell k8s_gw=api-gw-service-nmn.local quiet turbo_boost_limit=999 biosdevname=0", "name": "nid3", "network": "nmn",
-                    "path": "s3://boot-images/73ad471b-5cb1-4f55-9a73-c1c145058800/manifest.json",
-                    "rootfs_provider": "cpss3",
-                    "rootfs_provider_passthrough": "dvs:api-gw-service-nmn.local:300:eth0",
-                    "type": "s3",
-                    "node_roles_groups": ["Computes"]},
-                "RandyBitCoinMiner": {
-                    "etag": "1ad2687fa9320a7358f117934527c29b",
-                    "kernel_parameters": "console=ttyS0,115200 bad_page=panic crashkernel=256M hugepagelist=2m-2g intel_iommu=off intel_pstate=disable iommu=pt ip=dhcp numa_interleave_omit=headless numa_zonelist_order=node oops=panic pageblock_order=14 pcie_ports=native printk.synchronous=y rd.neednet=1 rd.retry=10 rd.shell k8s_gw=api-gw-service-nmn.local quiet turbo_boost_limit=999 biosdevname=0", "name": "nid3", "network": "nmn",
-                    "path": "s3://boot-images/73ad471b-5cb1-4f55-9a73-c1c145058800/manifest.json",
-                    "rootfs_provider": "cpss3",
-                    "rootfs_provider_passthrough": "dvs:api-gw-service-nmn.local:300:eth0",
-                    "type": "s3",
-                    "node_groups": ["ThisOne", "ThatOne", "TheOtherOne"]},
-                },
-                "cfs": {"branch": "master", "clone_url": "https://api-gw-service-nmn.local/vcs/cray/config-management.git"},
-                "description": "BOS session template for booting compute nodes, generated by the installation",
-                "enable_cfs": True,
-                "name": "unittest_sessiontemplate_%s" % (self.id)}
-        with open(self.file_path, 'w') as template_file:
-            template_file.write(json.dumps(obj))
+    @classmethod
+    def setUpClass(cls):
+        # Write a file representing a session; the agents only read it
+        fd, cls.file_path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as template_file:
+            template_file.write(_TEMPLATE_JSON)
 
-    def tearDown(self):
-        os.unlink(self.file_path)
+    @classmethod
+    def tearDownClass(cls):
+        os.unlink(cls.file_path)
 
     def test_creation(self):
         agent = BootSetAgent("session_%s" % (self.id), "template_%s" % (self.id),
@@ -111,6 +117,14 @@ class TestAgent(unittest.TestCase):
         self.assertTrue(agent.cfs_enabled, "We have all the right fields.")
         self.assertTrue(agent.cfs_configuration == '12345', 'not none, but: %s' % (agent.cfs_configuration))
 
+    def test_smd_client_is_shared(self):
+        agents = [BootSetAgent("session_%s" % (self.id), "template_%s" % (self.id),
+                               boot_set_name=name, operation="reboot", file_path=self.file_path)
+                  for name in ("Computes", "nid1")]
+        self.assertIs(agents[0].smd_client, agents[1].smd_client,
+                      "Boot sets share one HSM session so that their state queries can be merged.")
+
+
 
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
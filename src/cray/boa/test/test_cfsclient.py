@@ -0,0 +1,170 @@
+#
+# MIT License
+#
+# (C) Copyright 2022 Hewlett Packard Enterprise Development LP
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from mock import MagicMock
+from requests import Session
+
+import cray.boa.cfsclient as cfsclient
+from cray.boa.cfsclient import CfsClient, CFSExhaustedRetries, wait_for_configuration
+
+NODES = {'x3000c0s%db0n0' % slot for slot in range(60)}
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """
+    Record the polling loop's sleeps and advance a fake clock instead of sleeping.
+    """
+    slept = []
+    clock = [0.0]
+
+    def sleep(seconds):
+        slept.append(seconds)
+        clock[0] += seconds
+    monkeypatch.setattr(cfsclient, 'time', SimpleNamespace(time=lambda: clock[0], sleep=sleep))
+    monkeypatch.delenv('CFS_COMPLETION_SLEEP_INTERVAL', raising=False)
+    return slept
+
+
+@pytest.fixture
+def session(monkeypatch):
+    session = MagicMock(spec=Session)
+    monkeypatch.setattr(cfsclient, 'shared_session', lambda: session)
+    return session
+
+
+def cfs_statuses(session, sleeps, statuses, queries):
+    """
+    Make CFS report the configuration status <statuses>[n](node) for each requested
+    component after the n-th sleep (the last entry holds from then on). A status of
+    None leaves the component out of the response. Each query's ids go in <queries>.
+    """
+    def get(url, params=None, **kwargs):
+        ids = params['ids'].split(',')
+        queries.append(ids)
+        status_of = statuses[min(len(sleeps), len(statuses) - 1)]
+        response = MagicMock()
+        response.json.return_value = [{'id': node, 'configurationStatus': status_of(node)}
+                                      for node in ids if status_of(node) is not None]
+        return response
+    session.get.side_effect = get
+
+
+def boot_set_agent(client, nodes=NODES):
+    return SimpleNamespace(nodes=set(nodes), cfs_client=client,
+                           boot_set_status=MagicMock(), failed_nodes=set())
+
+
+class TestWaitForConfiguration(object):
+
+    def test_chunks_fan_out_over_shared_pool(self, monkeypatch, session, sleeps):
+        queries = []
+        cfs_statuses(session, sleeps, [lambda node: 'configured'], queries)
+        # Clients must not build pools of their own
+        monkeypatch.setattr(cfsclient, 'ThreadPoolExecutor', None)
+        for _ in range(2):
+            wait_for_configuration(boot_set_agent(CfsClient()))
+        assert len(queries) == 6
+        assert all(len(ids) <= 25 for ids in queries)
+        assert set().union(*queries[:3]) == set().union(*queries[3:]) == NODES
+
+    def test_exits_once_every_node_is_accounted_for(self, session, sleeps):
+        queries = []
+        cfs_statuses(session, sleeps, [lambda node: 'pending', lambda node: 'configured'],
+                     queries)
+        agent = boot_set_agent(CfsClient())
+        wait_for_configuration(agent)
+        assert len(sleeps) == 1
+        assert not agent.failed_nodes
+
+    def test_backs_off_without_progress(self, session, sleeps):
+        first = min(NODES)
+        queries = []
+        cfs_statuses(session, sleeps,
+                     [lambda node: 'pending',
+                      lambda node: 'pending',
+                      lambda node: 'pending',
+                      lambda node: 'configured' if node == first else 'pending',
+                      lambda node: 'pending' if node == first else 'configured'],
+                     queries)
+        wait_for_configuration(boot_set_agent(CfsClient()))
+        assert sleeps == [7.5, 11.25, 16.875, 5]
+        # Configured components are not requested again
+        assert first not in set(queries[-1]) | set(queries[-2]) | set(queries[-3])
+
+    def test_missing_component_fails(self, session, sleeps):
+        missing = min(NODES)
+        queries = []
+        cfs_statuses(session, sleeps,
+                     [lambda node: None if node == missing else 'configured'], queries)
+        agent = boot_set_agent(CfsClient())
+        with pytest.raises(CFSExhaustedRetries):
+            wait_for_configuration(agent)
+        assert agent.failed_nodes == {missing}
+
+    def test_missing_component_within_threshold(self, session, sleeps):
+        missing = min(NODES)
+        queries = []
+        cfs_statuses(session, sleeps,
+                     [lambda node: None if node == missing else 'configured'], queries)
+        agent = boot_set_agent(CfsClient())
+        wait_for_configuration(agent, success_threshold=0.9)
+        assert agent.failed_nodes == {missing}
+        assert not sleeps
+
+
+class TestSetConfiguration(object):
+
+    def test_batches_are_taken_as_requests_complete(self, monkeypatch, session):
+        monkeypatch.setattr(CfsClient, 'PATCH_BATCH_SIZE', 2)
+        monkeypatch.setattr(CfsClient, 'PATCH_WORKERS', 2)
+        taken = []
+        completed = [0]
+        lock = threading.Lock()
+
+        def node_ids():
+            for index in range(20):
+                taken.append(index)
+                yield 'x%d' % index
+
+        def patch(url, data=None, headers=None):
+            # Ids are only taken for the outstanding batches and the next one
+            assert len(taken) <= (completed[0] + 2 + 1) * 2
+            time.sleep(0.01)
+            with lock:
+                completed[0] += 1
+            return MagicMock()
+        session.patch.side_effect = patch
+        CfsClient().set_configuration(node_ids(), 'config')
+        assert completed[0] == 10
+        sent = [component for call in session.patch.call_args_list
+                for component in json.loads(call.kwargs['data'])]
+        assert sorted(component['id'] for component in sent) == \
+            sorted('x%d' % index for index in range(20))
+        assert all(component['desiredConfig'] == 'config' for component in sent)
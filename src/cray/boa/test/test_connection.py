@@ -0,0 +1,94 @@
+#
+# MIT License
+#
+# (C) Copyright 2022 Hewlett Packard Enterprise Development LP
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+import pytest
+from mock import patch
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import cray.boa.connection as connection
+
+DEFAULT_TIMEOUT = (3, 10)
+
+
+class Sent(Exception):
+    """
+    Raised in place of sending a request, so that the call can be inspected.
+    """
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    An adapter that applies a default timeout, as the retry session's own does.
+    """
+    def __init__(self, *args, timeout=DEFAULT_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+@pytest.fixture
+def retry_session(monkeypatch):
+    """
+    Make the underlying retry session mount timeout adapters with a retry policy.
+    """
+    retries = Retry(total=5)
+
+    def base_requests_retry_session(**kwargs):
+        session = Session()
+        for prefix in ('http://', 'https://'):
+            session.mount(prefix, TimeoutHTTPAdapter(max_retries=retries))
+        return session
+    monkeypatch.setattr(connection, '_base_requests_retry_session', base_requests_retry_session)
+    return retries
+
+
+class TestRequestsRetrySession(object):
+
+    def test_adapters_are_resized(self, retry_session):
+        session = connection.requests_retry_session(pool_connections=4, pool_maxsize=8)
+        for prefix in ('http://', 'https://'):
+            adapter = session.get_adapter(prefix)
+            assert type(adapter) is TimeoutHTTPAdapter
+            assert adapter.max_retries is retry_session
+            assert adapter.poolmanager.connection_pool_kw['maxsize'] == 8
+            assert len(adapter.poolmanager.pools.keys()) == 0
+
+    def test_default_timeout_is_applied(self, retry_session):
+        session = connection.requests_retry_session()
+        with patch.object(HTTPAdapter, 'send', side_effect=Sent) as send, \
+                pytest.raises(Sent):
+            session.get('https://api-gw-service-nmn.local/apis/bos/v1')
+        assert send.call_args[1]['timeout'] == DEFAULT_TIMEOUT
+
+    def test_explicit_timeout_wins(self, retry_session):
+        session = connection.requests_retry_session()
+        with patch.object(HTTPAdapter, 'send', side_effect=Sent) as send, \
+                pytest.raises(Sent):
+            session.get('https://api-gw-service-nmn.local/apis/bos/v1', timeout=1)
+        assert send.call_args[1]['timeout'] == 1
@@ -21,14 +21,24 @@
 # ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 # OTHER DEALINGS IN THE SOFTWARE.
 #
-import importlib
+import copy
+import json
 import os
 import pytest
 
 from cray.boa.rootfs.factory import ProviderFactory
+from cray.boa.rootfs.cpss3 import CPSS3Provider
 from cray.boa.agent import BootSetAgent
 import cray.boa.agent
 
+SESSION_TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                     'session_template.json')
+# Read once; each agent gets its own copy, since the agent fixture modifies it
+with open(SESSION_TEMPLATE_PATH) as _template_file:
+    _SESSION_DATA = json.load(_template_file)
+# The class ProviderFactory should produce for each provider name
+_PROVIDER_CLASSES = {'cpss3': CPSS3Provider}
+
 
 class MockS3Return(object):
 
@@ -44,41 +54,46 @@ class MockS3Return2(object):
         return 'image_param1 image_param2'
 
 
+@pytest.mark.parametrize('provider_name,root_fs_path,root_fs_id',
+                         [pytest.param('cpss3',
+                                       's3://boot-images/73ad471b-5cb1-4f55-9a73-c1c145058800/rootfs',
+                                       'Easy-as-123-and-ABC',
+                                       id='cpss3')],
+                         scope='session')
 class TestKernelParameters(object):
 
-    @pytest.fixture(params=['cpss3'])
-    def provider_name(self, request):
+    @pytest.fixture(scope='module', params=[pytest.param(param, id=param) for param in
+                                            ('template_param1', 'template_param2', 'template_param3')])
+    def boot_parameters(self, request):
         return request.param
 
-    @pytest.fixture(params=['s3://boot-images/73ad471b-5cb1-4f55-9a73-c1c145058800/rootfs'])
-    def root_fs_path(self, request):
-        return request.param
+    @pytest.fixture(scope='session')
+    def provider_class_def(self, provider_name):
+        """
+        The provider class that ProviderFactory should produce for <provider_name>
+        """
+        return _PROVIDER_CLASSES[provider_name]
 
-    @pytest.fixture(params=['Easy-as-123-and-ABC'])
-    def root_fs_id(self, request):
-        return request.param
+    @pytest.fixture(scope='session')
+    def expected_nmd(self, root_fs_path, root_fs_id):
+        return "nmd_data=url=%s,etag=%s" % (root_fs_path, root_fs_id)
 
-    @pytest.fixture(params=['template_param1', 'template_param2', 'template_param3'])
-    def boot_parameters(self, request):
-        return request.param
+    @pytest.fixture(scope='session')
+    def expected_root(self, provider_class_def, root_fs_path, root_fs_id):
+        return "root=%s" % (":".join([provider_class_def.PROTOCOL, root_fs_path, root_fs_id]))
 
     @pytest.fixture
     def mock_S3Object(*args, **kwargs):
         return {'Body': MockS3Return()}
 
-    @pytest.fixture
+    # The tests only read from the agent, so one is shared by every test that
+    # uses the same parameters
+    @pytest.fixture(scope='module')
     def agent(self, provider_name, root_fs_path, root_fs_id, boot_parameters):
-#        ag = BootSetAgent('services', '123', 'cle-1.3.0', '',
-#                          'computes', 'x3000c0s19b1n0', '', '', 'boot',
-#                          's3://boot-images/73ad471b-5cb1-4f55-9a73-c1c145058800/manifest.json', 's3', '',
-#                          'kernel=parameters', 'nmn', provider_name)
-        # print("Running agent fixture")
-        # import pdb;pdb.set_trace()
-        dir_path = os.path.dirname(os.path.realpath(__file__))
-        ag = BootSetAgent('123', 'cle-1.3.0', 'compute', 'boot', file_path='{}/session_template.json'.format(dir_path))
-        # Just call this to ensure that we initialize the session data, so it exists before
-        # we overwrite it.
-        _ = ag.session_data
+        ag = BootSetAgent('123', 'cle-1.3.0', 'compute', 'boot', file_path=SESSION_TEMPLATE_PATH)
+        # Initialize the session data from the template read at import, so it exists
+        # before we overwrite it.
+        ag._session_data = copy.deepcopy(_SESSION_DATA)
         ag._session_data['boot_sets']['compute']['rootfs_provider'] = provider_name
         ag._boot_artifacts = {}
         ag._boot_artifacts['rootfs'] = root_fs_path
@@ -88,37 +103,38 @@ class TestKernelParameters(object):
         ag.artifact_info['boot_parameters_etag'] = '/path/to/image_parameters_etag'
         return ag
 
-    def testFactoryOutput(self, agent, provider_name):
+    @pytest.fixture(scope='module')
+    def provider_class(self, agent):
+        """
+        The provider ProviderFactory produces for <agent>
+        """
+        return ProviderFactory(agent)()
+
+    def testFactoryOutput(self, provider_class, provider_class_def):
         """
         Test the output from the ProviderFactory class
         """
+        assert type(provider_class) is provider_class_def
 
-        pf = ProviderFactory(agent)
-        provider_class = pf()
-        provider_module = 'cray.boa.rootfs.{}'.format(provider_name)
-        provider_classname = '{}Provider'.format(provider_name.upper())
-        module = importlib.import_module(provider_module)
-        ClassDef = getattr(module, provider_classname)
-        assert type(provider_class) == type(ClassDef(agent))
+    def testAgentKeepsProvider(self, agent, provider_class_def):
+        """
+        Test that the agent builds its provider once and reuses it
+        """
+        provider = agent.rootfs_provider_instance
+        assert type(provider) is provider_class_def
+        assert agent.rootfs_provider_instance is provider
 
-    def testNMDParameter(self, agent, root_fs_path, root_fs_id):
+    def testNMDParameter(self, provider_class, expected_nmd):
         """
         Test that Node Memory Dump (NMD) parameter is as expected.
         """
-        pf = ProviderFactory(agent)
-        provider_class = pf()
-        nmd_parameter = provider_class.nmd_field
-        assert "nmd_data=url={},etag={}".format(root_fs_path, root_fs_id) == nmd_parameter
+        assert expected_nmd == provider_class.nmd_field
 
-    def testRootFSParameter(self, agent, root_fs_path, root_fs_id, provider_name):
+    def testRootFSParameter(self, provider_class, expected_root):
         """
         Test that Rootfs kernel parameter is as expected.
         """
-
-        pf = ProviderFactory(agent)
-        provider_class = pf()
-        root_parameter = str(provider_class)
-        assert "root={}".format(":".join([provider_class.PROTOCOL, root_fs_path, root_fs_id])) == root_parameter
+        assert expected_root == str(provider_class)
 
     def testKernelParameters(self, agent, mock_S3Object, monkeypatch):
         """
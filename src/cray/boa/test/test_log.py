@@ -0,0 +1,217 @@
+#
+# MIT License
+#
+# (C) Copyright 2022 Hewlett Packard Enterprise Development LP
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+import logging
+import socket
+import sys
+import threading
+
+import pytest
+
+from cray.boa.log import HEADER, MAX_FRAME_SIZE, SERIALIZERS
+from cray.boa.log.client import MsgpackHandler, UnixSeqpacketHandler
+from cray.boa.log.server import LogRecordSocketReceiver, LogRecordSeqpacketReceiver
+
+REMOTE_LOGGER = 'cray.boa.test.remote'
+
+
+class Capture(logging.Handler):
+    """
+    Collect the records the receiver logs, so a test can wait for them.
+    """
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+        self.received = threading.Condition()
+
+    def emit(self, record):
+        with self.received:
+            self.records.append(record)
+            self.received.notify_all()
+
+    def wait_for(self, count):
+        with self.received:
+            assert self.received.wait_for(lambda: len(self.records) >= count, timeout=5)
+        return self.records
+
+
+@pytest.fixture
+def capture():
+    logger = logging.getLogger(REMOTE_LOGGER)
+    handler = Capture()
+    logger.addHandler(handler)
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    yield handler
+    logger.removeHandler(handler)
+    logger.propagate = True
+
+
+@pytest.fixture(params=['tcp', 'seqpacket'])
+def transport(request, tmp_path):
+    """
+    A running receiver and a factory for client handlers connected to it, for
+    the requested transport and each serializer.
+    """
+    def start(serializer):
+        if request.param == 'tcp':
+            receiver = LogRecordSocketReceiver(host='127.0.0.1', port=0, serializer=serializer)
+            client = lambda: MsgpackHandler('127.0.0.1', receiver.server_address[1],
+                                            serializer=serializer)
+        else:
+            receiver = LogRecordSeqpacketReceiver(str(tmp_path / 'log.sock'), serializer=serializer)
+            client = lambda: UnixSeqpacketHandler(receiver.server_address, serializer=serializer)
+        thread = threading.Thread(target=receiver.serve_forever, args=(0.05,), daemon=True)
+        thread.start()
+        receivers.append((receiver, thread))
+        return client
+    receivers = []
+    yield start
+    for receiver, thread in receivers:
+        receiver.shutdown()
+        receiver.server_close()
+        thread.join(5)
+
+
+def make_record(msg, *args, exc_info=None):
+    return logging.LogRecord(REMOTE_LOGGER, logging.INFO, __file__, 1, msg, args, exc_info)
+
+
+@pytest.mark.parametrize('serializer', SERIALIZERS)
+class TestRoundTrip(object):
+
+    def test_records_arrive_in_order(self, transport, capture, serializer):
+        handler = transport(serializer)()
+        try:
+            for index in range(20):
+                handler.handle(make_record('record %d of %s', index, 20))
+        finally:
+            handler.close()
+        records = capture.wait_for(20)
+        assert [record.getMessage() for record in records] == \
+            ['record %d of 20' % index for index in range(20)]
+        assert all(record.levelno == logging.INFO for record in records)
+
+    def test_arbitrary_arguments(self, transport, capture, serializer):
+        handler = transport(serializer)()
+        try:
+            handler.handle(make_record('%s and %r', object(), {'key': {1, 2}}))
+        finally:
+            handler.close()
+        record, = capture.wait_for(1)
+        assert record.getMessage().startswith('<object object at ')
+        assert record.getMessage().endswith(" and {'key': {1, 2}}")
+
+    def test_unpackable_extra(self, transport, capture, serializer):
+        handler = transport(serializer)()
+        record = make_record('with extra')
+        record.__dict__.update({'node': 'x3000c0s19b1n0', 'nodes': frozenset(['x1']),
+                                'owner': object()})
+        try:
+            handler.handle(record)
+        finally:
+            handler.close()
+        record, = capture.wait_for(1)
+        assert record.getMessage() == 'with extra'
+        assert record.node == 'x3000c0s19b1n0'
+        assert record.nodes == "frozenset({'x1'})"
+        assert record.owner.startswith('<object object at ')
+
+    def test_exception_info(self, transport, capture, serializer):
+        handler = transport(serializer)()
+        try:
+            try:
+                raise RuntimeError('boom')
+            except RuntimeError:
+                handler.handle(make_record('failed', exc_info=sys.exc_info()))
+        finally:
+            handler.close()
+        record, = capture.wait_for(1)
+        assert record.exc_info is None
+        assert 'RuntimeError: boom' in record.exc_text
+
+
+@pytest.mark.parametrize('serializer', SERIALIZERS)
+def test_tcp_records_span_reads(capture, serializer):
+    """
+    Records larger than the receive buffer are reassembled from several reads.
+    """
+    receiver = LogRecordSocketReceiver(host='127.0.0.1', port=0, serializer=serializer)
+    thread = threading.Thread(target=receiver.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    handler = MsgpackHandler('127.0.0.1', receiver.server_address[1], serializer=serializer)
+    large = 'x' * (3 * LogRecordSocketReceiver.RECEIVE_BUFFER_SIZE)
+    try:
+        handler.handle(make_record(large))
+        handler.handle(make_record('after'))
+        records = capture.wait_for(2)
+    finally:
+        handler.close()
+        receiver.shutdown()
+        receiver.server_close()
+        thread.join(5)
+    assert [record.getMessage() for record in records] == [large, 'after']
+
+
+def test_tcp_oversized_frame_drops_connection(capture, caplog):
+    """
+    A length prefix over MAX_FRAME_SIZE, such as an unframed record from an older
+    client, closes that connection instead of being buffered; others carry on.
+    """
+    receiver = LogRecordSocketReceiver(host='127.0.0.1', port=0)
+    thread = threading.Thread(target=receiver.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    handler = MsgpackHandler('127.0.0.1', receiver.server_address[1])
+    try:
+        with socket.create_connection(receiver.server_address, timeout=5) as garbage:
+            garbage.sendall(HEADER.pack(MAX_FRAME_SIZE + 1) + b'\x93' * 64)
+            # The receiver closes its end rather than waiting for the frame
+            assert garbage.recv(1) == b''
+        handler.handle(make_record('after'))
+        record, = capture.wait_for(1)
+    finally:
+        handler.close()
+        receiver.shutdown()
+        receiver.server_close()
+        thread.join(5)
+    assert record.getMessage() == 'after'
+    assert any('larger than the %d byte limit' % MAX_FRAME_SIZE in entry.getMessage()
+               for entry in caplog.records)
+
+
+def test_seqpacket_stale_socket(tmp_path):
+    path = str(tmp_path / 'log.sock')
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    stale.bind(path)
+    stale.close()
+    receiver = LogRecordSeqpacketReceiver(path)
+    try:
+        # A second receiver must not take over the socket of a running one
+        with pytest.raises(OSError):
+            LogRecordSeqpacketReceiver(path)
+    finally:
+        receiver.server_close()
+    with open(path, 'w'):
+        pass
+    with pytest.raises(FileExistsError):
+        LogRecordSeqpacketReceiver(path)
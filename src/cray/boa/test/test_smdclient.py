@@ -0,0 +1,114 @@
+#
+# MIT License
+#
+# (C) Copyright 2022 Hewlett Packard Enterprise Development LP
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+import threading
+
+import pytest
+
+import cray.boa.smd.smdclient as smdclient
+from cray.boa.smd.smdclient import BulkStateFetcher
+
+
+class Queries(list):
+    """
+    The (nodes, session) of each query made; a query blocks until <release> is
+    set while its nodes include one in <hold>.
+    """
+    def __init__(self):
+        super().__init__()
+        self.hold = frozenset()
+        self.release = threading.Event()
+
+
+@pytest.fixture
+def queries(monkeypatch):
+    """
+    Answer get_bulk_nodes_info with every node Ready, recording each query.
+    """
+    recorded = Queries()
+
+    def get_bulk_nodes_info(nodes, session=None):
+        nodes = set(nodes)
+        recorded.append((nodes, session))
+        if nodes & recorded.hold:
+            assert recorded.release.wait(5)
+        return [{'ID': node, 'State': 'Ready'} for node in nodes]
+    monkeypatch.setattr(smdclient, 'get_bulk_nodes_info', get_bulk_nodes_info)
+    return recorded
+
+
+def call_in_thread(fetcher, nodes, session, results):
+    thread = threading.Thread(target=lambda: results.__setitem__(
+        frozenset(nodes), fetcher(nodes, session=session)))
+    thread.start()
+    return thread
+
+
+def wait_until(condition):
+    for _ in range(500):
+        if condition():
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError("Timed out waiting for condition")
+
+
+class TestBulkStateFetcher(object):
+
+    def test_single_caller_queries_at_once(self, queries):
+        fetcher = BulkStateFetcher()
+        session = object()
+        assert fetcher(['x1', 'x2'], session=session) == \
+            [{'ID': node, 'State': 'Ready'} for node in {'x1', 'x2'}]
+        assert queries == [({'x1', 'x2'}, session)]
+        assert not fetcher._in_flight and not fetcher._pending
+
+    def test_concurrent_callers_share_one_query(self, queries):
+        fetcher = BulkStateFetcher()
+        session = object()
+        queries.hold = frozenset(['x1'])
+        results = {}
+        first = call_in_thread(fetcher, ['x1'], session, results)
+        wait_until(lambda: len(queries) == 1)
+        # Both callers arrive while the first query is in flight
+        others = [call_in_thread(fetcher, [node], session, results) for node in ('x2', 'x3')]
+        wait_until(lambda: fetcher._pending.get(session, ({},))[0] == {'x2', 'x3'})
+        queries.release.set()
+        for thread in [first] + others:
+            thread.join(5)
+        assert [nodes for nodes, _ in queries] == [{'x1'}, {'x2', 'x3'}]
+        for node in ('x1', 'x2', 'x3'):
+            assert results[frozenset([node])] == [{'ID': node, 'State': 'Ready'}]
+        assert not fetcher._in_flight and not fetcher._pending
+
+    def test_sessions_are_not_shared(self, queries):
+        fetcher = BulkStateFetcher()
+        sessions = (object(), object())
+        queries.hold = frozenset(['x1'])
+        results = {}
+        first = call_in_thread(fetcher, ['x1'], sessions[0], results)
+        wait_until(lambda: len(queries) == 1)
+        # A query for another session is issued at once, with that session
+        assert fetcher(['x2'], session=sessions[1]) == [{'ID': 'x2', 'State': 'Ready'}]
+        queries.release.set()
+        first.join(5)
+        assert queries == [({'x1'}, sessions[0]), ({'x2'}, sessions[1])]
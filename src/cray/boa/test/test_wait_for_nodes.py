@@ -0,0 +1,196 @@
+#
+# MIT License
+#
+# (C) Copyright 2022 Hewlett Packard Enterprise Development LP
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+from types import SimpleNamespace
+
+from mock import MagicMock
+import pytest
+
+import cray.boa.smd.wait_for_nodes as wait_for_nodes
+from cray.boa.smd.wait_for_nodes import wait_for_state, NodeStateMismatch
+
+NODES = {'x3000c0s19b1n0', 'x3000c0s19b2n0', 'x3000c0s19b3n0'}
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """
+    Record the polling loops' sleeps and advance a fake clock instead of sleeping.
+    """
+    slept = []
+    clock = [0.0]
+
+    def sleep(seconds):
+        slept.append(seconds)
+        clock[0] += seconds
+    monkeypatch.setattr(wait_for_nodes, '_SLEEP', sleep)
+    monkeypatch.setattr(wait_for_nodes, 'time', SimpleNamespace(monotonic=lambda: clock[0]))
+    return slept
+
+
+def arriving_nodes(monkeypatch, arrivals):
+    """
+    Make filter_nodes_by_state report one more batch of <arrivals> in state per poll.
+    """
+    arrived = set()
+    batches = iter(arrivals)
+
+    def filter_nodes_by_state(state, node_list, invert, session):
+        arrived.update(next(batches, ()))
+        return arrived & set(node_list)
+    monkeypatch.setattr(wait_for_nodes, 'filter_nodes_by_state', filter_nodes_by_state)
+
+
+def changing_nodes(monkeypatch, sleeps, states, queries):
+    """
+    Make filter_nodes_by_state report the nodes in <states>[n] as in state after the
+    n-th sleep (the last entry holds from then on), recording each query in <queries>.
+    """
+    def filter_nodes_by_state(state, node_list, invert, session):
+        queries.append(set(node_list))
+        return states[min(len(sleeps), len(states) - 1)] & set(node_list)
+    monkeypatch.setattr(wait_for_nodes, 'filter_nodes_by_state', filter_nodes_by_state)
+
+
+class TestWaitForState(object):
+
+    def test_all_nodes_arrive(self, monkeypatch, sleeps):
+        arriving_nodes(monkeypatch, [{'x3000c0s19b1n0'}, set(), NODES])
+        assert wait_for_state(NODES, 'Ready', duration=600, session=object()) == set()
+        assert len(sleeps) == 2
+
+    def test_threshold_not_met(self, monkeypatch, sleeps):
+        arriving_nodes(monkeypatch, [{'x3000c0s19b1n0'}])
+        with pytest.raises(NodeStateMismatch):
+            wait_for_state(NODES, 'Ready', duration=60, session=object())
+        # Idle polling backs off, but never beyond MAX_SLEEP_TIME or past the duration
+        assert max(sleeps) > 5
+        assert all(delay <= wait_for_nodes.MAX_SLEEP_TIME for delay in sleeps)
+        assert sum(sleeps) == pytest.approx(60)
+
+    def test_no_nodes(self, sleeps):
+        assert wait_for_state(set(), 'Ready', session=object()) == set()
+        assert not sleeps
+
+    def test_node_leaves_state_after_matching(self, monkeypatch, sleeps):
+        queries = []
+        changing_nodes(monkeypatch, sleeps,
+                       [{'x3000c0s19b1n0'},
+                        {'x3000c0s19b2n0', 'x3000c0s19b3n0'},
+                        {'x3000c0s19b2n0', 'x3000c0s19b3n0'},
+                        NODES],
+                       queries)
+        assert wait_for_state(NODES, 'Ready', duration=600, session=object()) == set()
+        # Success was only declared once every node was seen in state at the same time
+        assert len(sleeps) == 3
+        assert queries[-1] == NODES
+
+    def test_timeout_uses_current_states(self, monkeypatch, sleeps):
+        queries = []
+        changing_nodes(monkeypatch, sleeps,
+                       [{'x3000c0s19b1n0'}, {'x3000c0s19b2n0', 'x3000c0s19b3n0'}],
+                       queries)
+        assert wait_for_state(NODES, 'Ready', duration=8, session=object(),
+                              success_threshold=0.5) == {'x3000c0s19b1n0'}
+
+
+class TestWaitForNodes(object):
+
+    def test_node_leaves_state_after_matching(self, monkeypatch, sleeps):
+        queries = []
+        changing_nodes(monkeypatch, sleeps,
+                       [{'x3000c0s19b1n0'},
+                        {'x3000c0s19b2n0', 'x3000c0s19b3n0'},
+                        {'x3000c0s19b2n0', 'x3000c0s19b3n0'},
+                        NODES],
+                       queries)
+        monkeypatch.setattr(wait_for_nodes, 'node_state_summary', lambda nodes: '')
+        agent = SimpleNamespace(nodes=set(NODES), smd_client=object())
+        wait_for_nodes.wait_for_nodes(agent, 'Ready', sleep_time=5)
+        assert len(sleeps) == 3
+        assert queries[-1] == NODES
+
+    def test_arrivals_reported_when_done(self, monkeypatch, sleeps):
+        arriving_nodes(monkeypatch, [{'x3000c0s19b1n0'}, NODES])
+        monkeypatch.setattr(wait_for_nodes, 'node_state_summary', lambda nodes: '')
+        agent = SimpleNamespace(nodes=set(NODES), smd_client=object(),
+                                boot_set_status=MagicMock())
+        wait_for_nodes.wait_for_nodes(agent, 'Ready', sleep_time=5, phase='boot',
+                                      source='in_progress', destination='succeeded')
+        reported = set()
+        for call in agent.boot_set_status.move_nodes.call_args_list:
+            assert call.args[1:] == ('boot', 'in_progress', 'succeeded')
+            reported |= call.args[0]
+        assert reported == NODES
+
+    def test_report_failure_keeps_original_error(self, monkeypatch, sleeps):
+        polls = iter([{'x3000c0s19b1n0'}])
+
+        def filter_nodes_by_state(state, node_list, invert, session):
+            try:
+                return next(polls) & set(node_list)
+            except StopIteration:
+                raise RuntimeError("HSM went away")
+        monkeypatch.setattr(wait_for_nodes, 'filter_nodes_by_state', filter_nodes_by_state)
+        monkeypatch.setattr(wait_for_nodes, 'node_state_summary', lambda nodes: '')
+        agent = SimpleNamespace(nodes=set(NODES), smd_client=object(),
+                                boot_set_status=MagicMock())
+        agent.boot_set_status.move_nodes.side_effect = ValueError("BOS went away")
+        with pytest.raises(RuntimeError):
+            wait_for_nodes.wait_for_nodes(agent, 'Ready', sleep_time=5, phase='boot',
+                                          source='in_progress', destination='succeeded')
+        agent.boot_set_status.move_nodes.assert_called_once()
+
+    def test_retries_bound_the_wait(self, monkeypatch, sleeps):
+        arriving_nodes(monkeypatch, [{'x3000c0s19b1n0'}])
+        monkeypatch.setattr(wait_for_nodes, 'node_state_summary', lambda nodes: '')
+        agent = SimpleNamespace(nodes=set(NODES), smd_client=object(),
+                                boot_set_status=MagicMock(), failed_nodes=set())
+        wait_for_nodes.wait_for_nodes(agent, 'Ready', sleep_time=5, allowed_retries=10,
+                                      phase='boot', source='in_progress', destination='succeeded')
+        # Idle polling backs off past sleep_time, and the sleeps, jitter included,
+        # add up to the allowed retries
+        assert max(sleeps) > 5 + 1
+        assert sum(sleeps) == pytest.approx((10 + 1) * 5)
+        assert agent.failed_nodes == NODES - {'x3000c0s19b1n0'}
+
+    def test_retries_end_after_a_short_sleep(self, monkeypatch, sleeps):
+        clock = [0.0]
+
+        def sleep(seconds):
+            # Wake a hair early, as float rounding of the capped final sleep can
+            sleeps.append(seconds)
+            clock[0] += seconds - 1e-9
+        monkeypatch.setattr(wait_for_nodes, '_SLEEP', sleep)
+        monkeypatch.setattr(wait_for_nodes, 'time', SimpleNamespace(monotonic=lambda: clock[0]))
+        arriving_nodes(monkeypatch, [{'x3000c0s19b1n0'}])
+        monkeypatch.setattr(wait_for_nodes, 'node_state_summary', lambda nodes: '')
+        agent = SimpleNamespace(nodes=set(NODES), smd_client=object(),
+                                boot_set_status=MagicMock(), failed_nodes=set())
+        wait_for_nodes.wait_for_nodes(agent, 'Ready', sleep_time=5, allowed_retries=10,
+                                      phase='boot', source='in_progress', destination='succeeded')
+        # The wait ends with the poll after the capped sleep, not with a run of
+        # back-to-back polls
+        assert min(sleeps) > 1e-6
+        assert sum(sleeps) == pytest.approx((10 + 1) * 5)
+        assert agent.failed_nodes == NODES - {'x3000c0s19b1n0'}